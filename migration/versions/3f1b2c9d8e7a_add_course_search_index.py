@@ -0,0 +1,122 @@
+"""Add course search index
+
+Revision ID: 3f1b2c9d8e7a
+Revises: aa1c5ce7d483
+Create Date: 2021-10-16 13:02:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import ormar
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1b2c9d8e7a"
+down_revision = "aa1c5ce7d483"
+branch_labels = None
+depends_on = None
+
+POSTGRES_VECTOR = """
+setweight(to_tsvector('simple', coalesce({row}name, '')), 'A') ||
+setweight(to_tsvector('simple', coalesce({row}notes_short, '')), 'B') ||
+setweight(to_tsvector('simple', coalesce({row}notes, '')), 'C')
+"""
+
+
+def upgrade_postgresql():
+    op.execute("ALTER TABLE courses ADD COLUMN search_vector tsvector")
+    op.execute("UPDATE courses SET search_vector = " + POSTGRES_VECTOR.format(row=""))
+    op.execute(
+        "CREATE INDEX ix_courses_search_vector ON courses USING GIN (search_vector)"
+    )
+    op.execute(
+        """
+        CREATE FUNCTION courses_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {vector};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """.format(
+            vector=POSTGRES_VECTOR.format(row="NEW.")
+        )
+    )
+    op.execute(
+        """
+        CREATE TRIGGER courses_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF name, notes_short, notes ON courses
+        FOR EACH ROW EXECUTE PROCEDURE courses_search_vector_update()
+        """
+    )
+
+
+def downgrade_postgresql():
+    op.execute("DROP TRIGGER courses_search_vector_trigger ON courses")
+    op.execute("DROP FUNCTION courses_search_vector_update()")
+    op.execute("DROP INDEX ix_courses_search_vector")
+    op.execute("ALTER TABLE courses DROP COLUMN search_vector")
+
+
+def upgrade_sqlite():
+    # course_id is only stored to join back, it is not part of the index.
+    op.execute(
+        """
+        CREATE VIRTUAL TABLE courses_fts USING fts5(
+            course_id UNINDEXED, name, notes_short, notes
+        )
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO courses_fts (course_id, name, notes_short, notes)
+        SELECT id, name, notes_short, notes FROM courses
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER courses_fts_insert AFTER INSERT ON courses BEGIN
+            INSERT INTO courses_fts (course_id, name, notes_short, notes)
+            VALUES (new.id, new.name, new.notes_short, new.notes);
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER courses_fts_delete AFTER DELETE ON courses BEGIN
+            DELETE FROM courses_fts WHERE course_id = old.id;
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER courses_fts_update
+        AFTER UPDATE OF name, notes_short, notes ON courses BEGIN
+            UPDATE courses_fts
+            SET name = new.name, notes_short = new.notes_short, notes = new.notes
+            WHERE course_id = old.id;
+        END
+        """
+    )
+
+
+def downgrade_sqlite():
+    op.execute("DROP TRIGGER courses_fts_update")
+    op.execute("DROP TRIGGER courses_fts_delete")
+    op.execute("DROP TRIGGER courses_fts_insert")
+    op.execute("DROP TABLE courses_fts")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        upgrade_postgresql()
+    elif dialect == "sqlite":
+        upgrade_sqlite()
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        downgrade_postgresql()
+    elif dialect == "sqlite":
+        downgrade_sqlite()
@@ -1,20 +1,40 @@
+import asyncio
+import traceback
+import typing as t
+
 import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi_limiter import FastAPILimiter
 
+from ta_backend.helper.archive import archive_loop
+from ta_backend.helper.circuit import RedisUnavailable
+from ta_backend.helper.compression import StreamAwareGZipMiddleware
 from ta_backend.helper.database import database
+from ta_backend.helper.events import course_events
+from ta_backend.helper.reminders import reminder_loop
 from ta_backend.helper.settings import settings
+from ta_backend.helper.stats import stats_loop
 from ta_backend.models import User
 from ta_backend.plugins import manager, redis
 from ta_backend.responses import DefaultResponse, UserResponse
 from ta_backend.routes.auth import router as AuthRouter
+from ta_backend.routes.calendar import router as CalendarRouter
 from ta_backend.routes.course import router as CourseRouter
+from ta_backend.routes.course import warm_course_cache
+from ta_backend.routes.stats import router as StatsRouter
+
+REDIS_STARTUP_RETRY_DELAY = 1
 
 app = FastAPI()
+app.state.warmed = False
+background_tasks: t.List[asyncio.Task] = []
 app.include_router(AuthRouter)
+app.include_router(CalendarRouter)
 app.include_router(CourseRouter)
+app.include_router(StatsRouter)
 origins = [
     "http://localhost",
     "http://localhost:3000",
@@ -26,7 +46,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=1000)
 
 if settings.sentry_url:
     sentry_sdk.init(
@@ -37,11 +59,42 @@ if settings.sentry_url:
     app.add_middleware(SentryAsgiMiddleware)
 
 
+@app.exception_handler(RedisUnavailable)
+async def redis_unavailable_handler(request: Request, exc: RedisUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service is temporarily unavailable."},
+    )
+
+
 @app.get("/", response_model=DefaultResponse)
 async def root():
     return {"message": "Hello world!"}
 
 
+@app.get("/ready", response_model=DefaultResponse)
+async def ready(response: Response):
+    """Tell the load balancer whether this worker should get traffic."""
+    # Redis is only required at startup, during a later outage every worker
+    # serves what it can through the circuit breaker
+    if not (app.state.warmed and database.is_connected):
+        response.status_code = 503
+        return {"message": "Not ready."}
+    return {"message": "Ready."}
+
+
+async def warm_up():
+    while not await redis.ping():
+        await asyncio.sleep(REDIS_STARTUP_RETRY_DELAY)
+
+    try:
+        await warm_course_cache(settings.warmup_concurrency, settings.warmup_batch_size)
+    except Exception:
+        # A cold cache is slower, not broken
+        traceback.print_exc()
+    app.state.warmed = True
+
+
 @app.get("/me", response_model=UserResponse)
 async def me(user: User = Depends(manager)):
     return user
@@ -53,9 +106,18 @@ async def on_startup():
         await database.connect()
 
     await FastAPILimiter.init(redis)
+    background_tasks.append(asyncio.create_task(warm_up()))
+    background_tasks.append(asyncio.create_task(archive_loop()))
+    background_tasks.append(asyncio.create_task(reminder_loop()))
+    background_tasks.append(asyncio.create_task(stats_loop()))
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    await course_events.stop()
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+
     if database.is_connected:
         await database.disconnect()
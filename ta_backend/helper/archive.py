@@ -0,0 +1,109 @@
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+import sqlalchemy
+
+from ta_backend.helper.cache import invalidate_courses
+from ta_backend.helper.database import database
+from ta_backend.helper.settings import settings
+from ta_backend.models import ArchivedCourse, ArchivedEnrollment, Course
+from ta_backend.plugins import redis
+
+ARCHIVE_LOCK_KEY = "archive--lock"
+COURSE_COLUMNS = [
+    "id",
+    "name",
+    "matkul",
+    "datetime",
+    "link",
+    "students_limit",
+    "notes",
+    "notes_short",
+    "hidden",
+    "teacher",
+]
+
+
+async def archive_batch(horizon: datetime, batch_size: int) -> int:
+    """Move at most batch_size courses that happened before horizon, along
+    with their enrollments, into the archive tables. Returns the number of
+    courses moved."""
+    courses = Course.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    archived_courses = ArchivedCourse.Meta.table
+    archived_enrollments = ArchivedEnrollment.Meta.table
+
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select([courses.c.id])
+            .where(courses.c.datetime < horizon)
+            .order_by(courses.c.datetime)
+            .limit(batch_size)
+        )
+        course_ids = [row[0] for row in rows]
+        if not course_ids:
+            return 0
+
+        students_count = (
+            sqlalchemy.select([sqlalchemy.func.count()])
+            .where(enrollments.c.course == courses.c.id)
+            .scalar_subquery()
+        )
+        archived_at = sqlalchemy.literal(
+            datetime.utcnow().replace(tzinfo=pytz.utc),
+            sqlalchemy.DateTime(timezone=True),
+        )
+        await database.execute(
+            archived_courses.insert().from_select(
+                COURSE_COLUMNS + ["students_count", "archived_at"],
+                sqlalchemy.select(
+                    [courses.c[column] for column in COURSE_COLUMNS]
+                    + [students_count, archived_at]
+                ).where(courses.c.id.in_(course_ids)),
+            )
+        )
+        await database.execute(
+            archived_enrollments.insert().from_select(
+                ["course", "user"],
+                sqlalchemy.select([enrollments.c.course, enrollments.c.user]).where(
+                    enrollments.c.course.in_(course_ids)
+                ),
+            )
+        )
+        await database.execute(
+            enrollments.delete().where(enrollments.c.course.in_(course_ids))
+        )
+        await database.execute(courses.delete().where(courses.c.id.in_(course_ids)))
+
+    await invalidate_courses(course_ids)
+    return len(course_ids)
+
+
+async def archive_past_courses() -> int:
+    horizon = datetime.utcnow().replace(tzinfo=pytz.utc) - timedelta(
+        days=settings.archive_after_days
+    )
+
+    total = 0
+    while True:
+        moved = await archive_batch(horizon, settings.archive_batch_size)
+        total += moved
+        if moved < settings.archive_batch_size:
+            return total
+
+
+async def archive_loop():
+    """Periodically compact the courses table. Only one worker runs the job
+    in each interval, the others skip it while the lock is held."""
+    while True:
+        try:
+            if await redis.set(
+                ARCHIVE_LOCK_KEY, 1, nx=True, ex=settings.archive_interval
+            ):
+                await archive_past_courses()
+        except Exception:
+            traceback.print_exc()
+
+        await asyncio.sleep(settings.archive_interval)
@@ -0,0 +1,82 @@
+import hashlib
+import time
+import typing as t
+
+from fastapi import Request
+
+from ta_backend.plugins import principal_key, redis
+
+CATALOG_VERSION_KEY = "catalog--version"
+
+
+def course_detail_key(course_id) -> str:
+    return f"{str(course_id)}--detail"
+
+
+def course_version_key(course_id) -> str:
+    return f"{str(course_id)}--version"
+
+
+def user_courses_version_key(npm: int) -> str:
+    return f"{npm}--courses-version"
+
+
+async def get_versions(*keys: str) -> t.List[str]:
+    """Fetch version counters, initializing the missing ones.
+
+    A missing counter starts from the current time rather than zero, so a
+    flushed Redis can never hand out a version a client has seen before."""
+    versions = await redis.mget(*keys)
+    missing = [key for key, version in zip(keys, versions) if version is None]
+    if missing:
+        pipe = redis.pipeline(transaction=False)
+        for key in missing:
+            pipe.set(key, time.time_ns(), nx=True)
+        await pipe.execute()
+        versions = await redis.mget(*keys)
+    return versions
+
+
+async def invalidate_course(
+    course_id,
+    *keys: str,
+    npms: t.Iterable[int] = (),
+):
+    """Drop cached keys and bump the version of both the course and the
+    catalog, all in one round trip. npms lists the users whose set of
+    enrolled or owned courses changed."""
+    await invalidate_courses([course_id], *keys, npms=npms)
+
+
+async def invalidate_courses(
+    course_ids: t.Iterable,
+    *keys: str,
+    npms: t.Iterable[int] = (),
+):
+    """Same as invalidate_course, for many courses at once. Their detail
+    caches are dropped as well."""
+    pipe = redis.pipeline(transaction=False)
+    pipe.incr(CATALOG_VERSION_KEY)
+    for course_id in course_ids:
+        pipe.delete(course_detail_key(course_id))
+        pipe.incr(course_version_key(course_id))
+    if keys:
+        pipe.delete(*keys)
+    for npm in npms:
+        pipe.incr(user_courses_version_key(npm))
+        pipe.delete(principal_key(npm))
+    await pipe.execute()
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
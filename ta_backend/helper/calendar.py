@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import re
+import typing as t
+from datetime import datetime, timedelta
+
+from ta_backend.helper.discord import format_jkt
+from ta_backend.helper.settings import settings
+from ta_backend.models import Course, Subject
+
+ICS_DATETIME_FMT = "%Y%m%dT%H%M%S"
+EVENT_DURATION = timedelta(hours=1)
+NPM_RE = re.compile(r"[0-9]+")
+
+CALENDAR_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//Tutor Angkatan//Courses//EN\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "X-WR-CALNAME:Tutor Angkatan\r\n"
+    "BEGIN:VTIMEZONE\r\n"
+    "TZID:Asia/Jakarta\r\n"
+    "BEGIN:STANDARD\r\n"
+    "DTSTART:19700101T000000\r\n"
+    "TZOFFSETFROM:+0700\r\n"
+    "TZOFFSETTO:+0700\r\n"
+    "TZNAME:WIB\r\n"
+    "END:STANDARD\r\n"
+    "END:VTIMEZONE\r\n"
+)
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+
+def _sign(npm: int) -> str:
+    return hmac.new(
+        settings.secret.encode(),
+        f"calendar:{npm}".encode(),
+        hashlib.sha256,
+    ).hexdigest()[:32]
+
+
+def calendar_token(npm: int) -> str:
+    return f"{npm}-{_sign(npm)}"
+
+
+def parse_calendar_token(token: str) -> t.Optional[int]:
+    """Return NPM of the token owner, or None if token is forged.
+    Tokens are signed instead of stored, so this needs no lookup."""
+    npm_str, _, signature = token.partition("-")
+    # isdigit() also accepts digits int() rejects, such as superscripts
+    if not NPM_RE.fullmatch(npm_str):
+        return None
+
+    npm = int(npm_str)
+    # compare_digest only takes ASCII strings, the token comes from the URL
+    if not hmac.compare_digest(signature.encode(), _sign(npm).encode()):
+        return None
+    return npm
+
+
+def _escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Split content line into 75 octet chunks, as required by RFC 5545."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    chunks = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Do not split in the middle of a multibyte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        limit = 74  # Continuation lines start with a space
+    return "\r\n ".join(chunks) + "\r\n"
+
+
+def render_event(course: Course) -> str:
+    description = (
+        f"Teacher: {course.teacher.name}\nMatkul: {Subject(course.matkul).name}"
+    )
+    if course.notes_short:
+        description += f"\n\n{course.notes_short}"
+
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{str(course.id)}@{settings.hostname}",
+        f"DTSTAMP:{datetime.utcnow().strftime(ICS_DATETIME_FMT)}Z",
+        f"DTSTART;TZID=Asia/Jakarta:{format_jkt(course.datetime, ICS_DATETIME_FMT)}",
+        "DTEND;TZID=Asia/Jakarta:"
+        + format_jkt(course.datetime + EVENT_DURATION, ICS_DATETIME_FMT),
+        f"SUMMARY:{_escape(course.name)}",
+        f"DESCRIPTION:{_escape(description)}",
+    ]
+    if course.link:
+        lines.append(f"URL:{course.link}")
+    lines.append("END:VEVENT")
+
+    return "".join(_fold(line) for line in lines)
@@ -0,0 +1,382 @@
+import asyncio
+import fnmatch
+import hashlib
+import time
+import traceback
+import typing as t
+
+import aioredis
+from aioredis.exceptions import NoScriptError
+from fastapi_limiter import FastAPILimiter
+
+# Errors that mean Redis could not be reached in time, as opposed to errors
+# in the command itself
+REDIS_FAILURES = (asyncio.TimeoutError, OSError)
+
+# Commands routed through the circuit breaker
+REDIS_COMMANDS = frozenset(
+    {
+        "get",
+        "set",
+        "mget",
+        "delete",
+        "incr",
+        "exists",
+        "expire",
+        "expireat",
+        "hset",
+        "hincrby",
+        "hgetall",
+        "sadd",
+        "srem",
+        "smembers",
+        "zadd",
+        "zincrby",
+        "zrem",
+        "zrank",
+        "zrange",
+        "zpopmin",
+        "publish",
+    }
+)
+# Commands that fall back to MemoryRedis, and only when every key they
+# touch is a cache key. Anything else has to persist, so it fails instead
+# of being kept in one worker's memory and lost on recovery.
+CACHE_COMMANDS = frozenset({"get", "set", "mget", "delete", "incr", "exists", "expire"})
+FLUSH_BATCH_SIZE = 500
+
+
+class RedisUnavailable(aioredis.ConnectionError):
+    """Raised for commands that cannot be served while Redis is down."""
+
+
+async def best_effort(awaitable: t.Awaitable) -> t.Any:
+    """Await a Redis side effect of a change already committed to the
+    database, returning None when Redis is unavailable. Failing the request
+    then would make the client retry a change that went through."""
+    try:
+        return await awaitable
+    except RedisUnavailable:
+        return None
+
+
+def _script_sha(script: str) -> str:
+    return hashlib.sha1(script.encode()).hexdigest()
+
+
+def _command_keys(name: str, args: tuple) -> t.List[str]:
+    if name == "mget":
+        keys, *rest = args
+        return [keys, *rest] if isinstance(keys, str) else [*keys, *rest]
+    if name in ("delete", "exists"):
+        return list(args)
+    return [args[0]]
+
+
+class MemoryRedis:
+    """Per-worker stand-in for Redis, holding only cache keys and rate limits
+    during an outage. State is not shared between workers, which is good
+    enough for both."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self.data: t.Dict[str, t.Any] = {}
+        self.expires: t.Dict[str, float] = {}
+        self.scripts: t.Dict[str, t.Callable[..., t.Awaitable]] = {
+            _script_sha(FastAPILimiter.lua_script): self._limit,
+        }
+
+    def clear(self):
+        self.data.clear()
+        self.expires.clear()
+
+    def _lookup(self, name: str, default=None):
+        deadline = self.expires.get(name)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(name, None)
+            self.expires.pop(name, None)
+        return self.data.get(name, default)
+
+    def _store(self, name: str, value):
+        if name not in self.data and len(self.data) >= self.max_keys:
+            now = time.time()
+            for key in [k for k, d in self.expires.items() if d <= now]:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            # Still full, drop the oldest keys
+            while len(self.data) >= self.max_keys:
+                key = next(iter(self.data))
+                self.data.pop(key)
+                self.expires.pop(key, None)
+        self.data[name] = value
+        return value
+
+    async def get(self, name: str) -> t.Optional[str]:
+        return self._lookup(name)
+
+    async def set(
+        self,
+        name: str,
+        value,
+        ex: t.Optional[int] = None,
+        px: t.Optional[int] = None,
+        nx: bool = False,
+        xx: bool = False,
+    ) -> t.Optional[bool]:
+        exists = self._lookup(name) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+
+        self._store(name, str(value))
+        self.expires.pop(name, None)
+        if ex is not None:
+            self.expires[name] = time.time() + ex
+        elif px is not None:
+            self.expires[name] = time.time() + px / 1000
+        return True
+
+    async def mget(self, keys, *args) -> t.List[t.Optional[str]]:
+        names = [keys, *args] if isinstance(keys, str) else [*keys, *args]
+        return [self._lookup(name) for name in names]
+
+    async def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._lookup(name) is not None:
+                deleted += 1
+            self.data.pop(name, None)
+            self.expires.pop(name, None)
+        return deleted
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        value = int(self._lookup(name, 0)) + amount
+        self._store(name, str(value))
+        return value
+
+    async def exists(self, *names: str) -> int:
+        return sum(self._lookup(name) is not None for name in names)
+
+    async def expire(self, name: str, time_: int) -> bool:
+        if self._lookup(name) is None:
+            return False
+        self.expires[name] = time.time() + time_
+        return True
+
+    async def script_load(self, script: str) -> str:
+        return _script_sha(script)
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        return await self.scripts[sha](*keys_and_args)
+
+    async def _limit(self, key: str, times: str, milliseconds: str) -> int:
+        """Same as the FastAPILimiter script, returns the milliseconds left
+        when over the limit, or 0."""
+        current = int(self._lookup(key, 0))
+        if current > 0:
+            if current + 1 > int(times):
+                return int((self.expires.get(key, time.time()) - time.time()) * 1000)
+            await self.incr(key)
+            return 0
+
+        await self.set(key, 1, px=int(milliseconds))
+        return 0
+
+
+class ResilientScript:
+    def __init__(self, redis: "ResilientRedis", script: str):
+        self.redis = redis
+        self.sha = redis.remember_script(script)
+
+    async def __call__(self, keys: t.Sequence = (), args: t.Sequence = ()):
+        return await self.redis.evalsha(self.sha, len(keys), *keys, *args)
+
+
+class ResilientPipeline:
+    """Buffers commands like an aioredis pipeline, then sends them to Redis
+    or to the in-memory fallback as a whole."""
+
+    def __init__(self, redis: "ResilientRedis", transaction: bool = True):
+        self.redis = redis
+        self.transaction = transaction
+        self.commands: t.List[t.Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        if name not in REDIS_COMMANDS:
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    async def execute(self) -> t.List:
+        commands, self.commands = self.commands, []
+
+        async def remote():
+            pipe = self.redis.client.pipeline(transaction=self.transaction)
+            for name, args, kwargs in commands:
+                getattr(pipe, name)(*args, **kwargs)
+            return await pipe.execute()
+
+        async def local():
+            memory = self.redis.memory
+            return [
+                await getattr(memory, name)(*args, **kwargs)
+                for name, args, kwargs in commands
+            ]
+
+        is_cache = all(
+            self.redis.is_cache_command(name, args) for name, args, _ in commands
+        )
+        return await self.redis.execute(remote, local if is_cache else None)
+
+
+class ResilientRedis:
+    """Redis client with a deadline on every call and a circuit breaker.
+
+    A failed or slow call opens the circuit right away, since whatever it
+    wrote only reached the in-memory fallback. While open, cache commands
+    and the rate limiter are served by a per-worker MemoryRedis without
+    touching the network, and every other command raises RedisUnavailable.
+    After reset_timeout a background task flushes the cache keys from
+    Redis, and the circuit closes once that succeeds, so no cache entry
+    that missed an invalidation during the outage survives it."""
+
+    def __init__(
+        self,
+        client: aioredis.Redis,
+        timeout: float,
+        reset_timeout: float,
+        flush_timeout: float,
+        cache_patterns: t.Sequence[str] = (),
+    ):
+        self.client = client
+        self.memory = MemoryRedis()
+        self.timeout = timeout
+        self.reset_timeout = reset_timeout
+        self.flush_timeout = flush_timeout
+        self.cache_patterns = cache_patterns
+        self.opened_at: t.Optional[float] = None
+        self.scripts: t.Dict[str, str] = {}
+        self._recovery: t.Optional[asyncio.Task] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def open(self):
+        if not self.is_open:
+            traceback.print_exc()
+        self.opened_at = time.monotonic()
+
+    async def ping(self) -> bool:
+        """Check that Redis answers in time, without any fallback. Only the
+        recovery closes the circuit again."""
+        try:
+            await asyncio.wait_for(self.client.ping(), self.timeout)
+        except REDIS_FAILURES:
+            self.open()
+            return False
+        return True
+
+    def is_cache_command(self, name: str, args: tuple) -> bool:
+        return name in CACHE_COMMANDS and all(
+            any(fnmatch.fnmatchcase(key, p) for p in self.cache_patterns)
+            for key in _command_keys(name, args)
+        )
+
+    async def execute(
+        self,
+        remote: t.Callable[[], t.Awaitable],
+        local: t.Optional[t.Callable[[], t.Awaitable]],
+    ):
+        """Run remote against Redis, or local against memory when the
+        circuit is open. Commands without local fail while it is open."""
+        if self.opened_at is None:
+            try:
+                return await asyncio.wait_for(remote(), self.timeout)
+            except REDIS_FAILURES:
+                self.open()
+        elif (
+            self._recovery is None
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self._recovery = asyncio.ensure_future(self._recover())
+
+        if local is None:
+            raise RedisUnavailable("Redis is unavailable.")
+        return await local()
+
+    async def _flush_cache(self):
+        batch: t.List[str] = []
+        async for key in self.client.scan_iter(count=FLUSH_BATCH_SIZE):
+            if any(fnmatch.fnmatchcase(key, p) for p in self.cache_patterns):
+                batch.append(key)
+            if len(batch) >= FLUSH_BATCH_SIZE:
+                await self.client.delete(*batch)
+                batch = []
+        if batch:
+            await self.client.delete(*batch)
+
+    async def _recover(self):
+        try:
+            await asyncio.wait_for(self._flush_cache(), self.flush_timeout)
+        except REDIS_FAILURES:
+            self.opened_at = time.monotonic()
+        else:
+            self.memory.clear()
+            self.opened_at = None
+        finally:
+            self._recovery = None
+
+    def __getattr__(self, name: str):
+        if name not in REDIS_COMMANDS:
+            return getattr(self.client, name)
+
+        async def command(*args, **kwargs):
+            return await self.execute(
+                lambda: getattr(self.client, name)(*args, **kwargs),
+                (lambda: getattr(self.memory, name)(*args, **kwargs))
+                if self.is_cache_command(name, args)
+                else None,
+            )
+
+        return command
+
+    def pipeline(self, transaction: bool = True) -> ResilientPipeline:
+        return ResilientPipeline(self, transaction)
+
+    def remember_script(self, script: str) -> str:
+        sha = _script_sha(script)
+        self.scripts[sha] = script
+        return sha
+
+    def register_script(self, script: str) -> ResilientScript:
+        return ResilientScript(self, script)
+
+    async def script_load(self, script: str) -> str:
+        sha = self.remember_script(script)
+        await self.execute(
+            lambda: self.client.script_load(script),
+            lambda: self.memory.script_load(script),
+        )
+        return sha
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        async def remote():
+            try:
+                return await self.client.evalsha(sha, numkeys, *keys_and_args)
+            except NoScriptError:
+                # Redis restarted, or was down when the script was loaded
+                if sha not in self.scripts:
+                    raise
+                await self.client.script_load(self.scripts[sha])
+                return await self.client.evalsha(sha, numkeys, *keys_and_args)
+
+        return await self.execute(
+            remote,
+            (lambda: self.memory.evalsha(sha, numkeys, *keys_and_args))
+            if sha in self.memory.scripts
+            else None,
+        )
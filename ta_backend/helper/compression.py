@@ -0,0 +1,17 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """GZip responses, except for event streams. GzipFile holds small
+    writes back until it has enough data, which would delay every event
+    until the buffer fills up."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if "text/event-stream" in headers.get("Accept", ""):
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
@@ -1,4 +1,5 @@
-from datetime import timedelta, timezone
+import typing as t
+from datetime import datetime, timedelta, timezone
 import httpx
 
 from ta_backend.models import Course, Subject
@@ -7,19 +8,45 @@ jkt_timezone = timezone(timedelta(hours=7))
 description_fmt = "Course Name: {}\nTeacher: {}\nMatkul: {}\nDatetime: {}\nStudent Limit: {}\n\nCourse Code:```{}```"
 
 
-def generate_webhook(course: Course):
-    data = {"embeds": [{"title": "New Course!", "description": ""}]}
+def format_jkt(dt: datetime, fmt: str = "%Y-%m-%dT%H:%M:%S") -> str:
+    return dt.astimezone(jkt_timezone).strftime(fmt)
+
+
+def generate_webhook(course: Course, title: str = "New Course!"):
+    data = {"embeds": [{"title": title, "description": ""}]}
     data["embeds"][0]["description"] = description_fmt.format(
         course.name,
         course.teacher.name,
         Subject(course.matkul).name,
-        course.datetime.astimezone(jkt_timezone).strftime("%Y-%m-%dT%H:%M:%S"),
+        format_jkt(course.datetime),
         str(course.students_limit) if course.students_limit else "Infinity",
         str(course.id),
     )
     return data
 
 
+def generate_series_webhook(courses: t.List[Course]):
+    """Announce every occurrence of a series in a single message."""
+    data = generate_webhook(courses[0], title="New Course Series!")
+    data["embeds"][0]["description"] += "\n\nSessions:\n" + "\n".join(
+        f"{format_jkt(c.datetime)} ```{str(c.id)}```" for c in courses
+    )
+    return data
+
+
 async def send_webhook(webhook_url: str, course: Course):
     async with httpx.AsyncClient() as client:
         await client.post(webhook_url, json=generate_webhook(course))
+
+
+async def send_reminder_webhook(webhook_url: str, course: Course):
+    async with httpx.AsyncClient() as client:
+        await client.post(
+            webhook_url,
+            json=generate_webhook(course, title="Course starting soon!"),
+        )
+
+
+async def send_series_webhook(webhook_url: str, courses: t.List[Course]):
+    async with httpx.AsyncClient() as client:
+        await client.post(webhook_url, json=generate_series_webhook(courses))
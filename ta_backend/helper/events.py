@@ -0,0 +1,89 @@
+import asyncio
+import traceback
+import typing as t
+
+import ujson
+
+from ta_backend.helper.circuit import RedisUnavailable
+from ta_backend.models import Course
+from ta_backend.plugins import redis
+
+COURSE_EVENTS_CHANNEL = "course-events"
+SUBSCRIBER_QUEUE_SIZE = 64
+RECONNECT_DELAY = 1
+
+
+async def publish_course_event(
+    event: str,
+    course: Course,
+    students_count: t.Optional[int] = None,
+):
+    """Broadcast a change of course to every worker through Redis."""
+    data = {
+        "event": event,
+        "id": str(course.id),
+        "students_count": students_count,
+        "students_limit": course.students_limit,
+        "hidden": course.hidden,
+    }
+    try:
+        await redis.publish(COURSE_EVENTS_CHANNEL, ujson.dumps(data))
+    except RedisUnavailable:
+        # Live updates are skipped during an outage, clients catch up
+        # through the ETag of their next poll
+        pass
+
+
+class CourseEventBroker:
+    """Fan out a single Redis subscription to every streaming client
+    connected to this worker. Each client gets its own bounded queue, so
+    a slow client only ever loses its own oldest events."""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._subscribers: t.Set[asyncio.Queue] = set()
+        self._task: t.Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _dispatch(self, event: t.Dict):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _listen(self):
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._dispatch(ujson.loads(message["data"]))
+            except Exception:
+                # Any failure only restarts the subscription, the listener
+                # must outlive it or every stream stops getting events
+                traceback.print_exc()
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    traceback.print_exc()
+
+
+course_events = CourseEventBroker(COURSE_EVENTS_CHANNEL)
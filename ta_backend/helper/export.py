@@ -0,0 +1,58 @@
+import csv
+import io
+import typing as t
+from datetime import datetime
+from uuid import UUID
+
+import ujson
+from sqlalchemy.sql import Select
+
+from ta_backend.helper.database import database
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+EXPORT_FORMAT_REGEX = "^(csv|ndjson)$"
+EXPORT_CHUNK_ROWS = 100
+
+
+def _serialize(value):
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_line(values: t.Iterable) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+async def stream_export(
+    query: Select,
+    columns: t.List[str],
+    fmt: str,
+) -> t.AsyncIterator[str]:
+    """Stream the result of query as CSV or NDJSON. Rows are read through a
+    cursor and sent in small chunks, so memory use does not depend on the
+    size of the result."""
+    chunk: t.List[str] = []
+    if fmt == "csv":
+        chunk.append(_csv_line(columns))
+
+    async for row in database.iterate(query):
+        values = [_serialize(row[column]) for column in columns]
+        if fmt == "csv":
+            chunk.append(_csv_line(values))
+        else:
+            chunk.append(ujson.dumps(dict(zip(columns, values))) + "\n")
+
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+
+    if chunk:
+        yield "".join(chunk)
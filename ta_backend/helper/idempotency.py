@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import typing as t
+
+import ujson
+from fastapi import Depends, Header, HTTPException
+from fastapi_limiter.depends import RateLimiter
+from starlette.requests import Request
+from starlette.responses import Response
+
+from ta_backend.helper.circuit import best_effort
+from ta_backend.models import User
+from ta_backend.plugins import manager, redis
+
+IN_PROGRESS = "in-progress"
+LOCK_TIMEOUT = 30
+RESULT_TTL = 24 * 60 * 60
+POLL_INTERVAL = 0.1
+
+
+def idempotency_key(npm: int, scope: str, key: str) -> str:
+    return f"{npm}:{scope}:{key}--idempotency"
+
+
+class IdempotentRateLimiter(RateLimiter):
+    """RateLimiter that lets retries through. A request whose
+    Idempotency-Key already has a record, finished or in progress, is not
+    counted, so run_idempotent can replay or wait for it."""
+
+    def __init__(self, scope: str, **kwargs):
+        super().__init__(**kwargs)
+        self.scope = scope
+
+    async def __call__(
+        self,
+        request: Request,
+        response: Response,
+        user: User = Depends(manager),
+        key: t.Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+    ):
+        if key and await redis.exists(idempotency_key(user.npm, self.scope, key)):
+            return None
+        return await super().__call__(request, response)
+
+
+def _replay(record: t.Dict, fingerprint: str):
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request.",
+        )
+    if record["status_code"] != 200:
+        raise HTTPException(status_code=record["status_code"], detail=record["body"])
+    return record["body"]
+
+
+async def run_idempotent(
+    key: t.Optional[str],
+    npm: int,
+    scope: str,
+    fingerprint_data: str,
+    handler: t.Callable[[], t.Awaitable[t.Any]],
+):
+    """Run handler once per Idempotency-Key, replaying its outcome to every
+    retry. A retry that arrives while the first request is still running
+    waits for it to finish instead of running handler again."""
+    if not key:
+        return await handler()
+
+    redis_key = idempotency_key(npm, scope, key)
+    fingerprint = hashlib.sha1(fingerprint_data.encode()).hexdigest()
+
+    waited = 0.0
+    while not await redis.set(redis_key, IN_PROGRESS, nx=True, ex=LOCK_TIMEOUT):
+        record_json: t.Optional[str] = await redis.get(redis_key)
+        if record_json and record_json != IN_PROGRESS:
+            return _replay(ujson.loads(record_json), fingerprint)
+
+        if waited >= LOCK_TIMEOUT:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress.",
+            )
+        await asyncio.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+
+    try:
+        body = await handler()
+        status_code = 200
+    except HTTPException as e:
+        body = e.detail
+        status_code = e.status_code
+    except Exception:
+        # Unexpected failures are not recorded, so the client can retry
+        await best_effort(redis.delete(redis_key))
+        raise
+
+    # The outcome is returned even if Redis went away meanwhile, the change
+    # is already made
+    record = {"fingerprint": fingerprint, "status_code": status_code, "body": body}
+    await best_effort(redis.set(redis_key, ujson.dumps(record), ex=RESULT_TTL))
+    return _replay(record, fingerprint)
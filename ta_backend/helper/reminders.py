@@ -0,0 +1,108 @@
+import asyncio
+import time
+import traceback
+import typing as t
+from datetime import timedelta
+from uuid import UUID
+
+from ta_backend.helper.discord import send_reminder_webhook
+from ta_backend.helper.settings import settings
+from ta_backend.models import Course
+from ta_backend.plugins import redis
+
+REMINDER_QUEUE_KEY = "reminders--queue"
+
+# Pop every due reminder in one step, so a reminder is only ever claimed
+# by a single worker.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+end
+return due
+"""
+claim_script = redis.register_script(CLAIM_SCRIPT)
+
+ReminderChannel = t.Callable[[Course], t.Awaitable[None]]
+reminder_channels: t.List[ReminderChannel] = []
+
+
+def reminder_channel(func: ReminderChannel) -> ReminderChannel:
+    """Register a function to be called with every course due for a
+    reminder."""
+    reminder_channels.append(func)
+    return func
+
+
+@reminder_channel
+async def discord_reminder(course: Course):
+    if settings.discord_url and not course.hidden:
+        await send_reminder_webhook(settings.discord_url, course)
+
+
+async def schedule_reminder(course: Course):
+    """Schedule reminder of course, replacing the previous one if any."""
+    await schedule_reminders([course])
+
+
+async def schedule_reminders(courses: t.Iterable[Course]):
+    remind_before = timedelta(minutes=settings.reminder_before)
+    await redis.zadd(
+        REMINDER_QUEUE_KEY,
+        {str(c.id): (c.datetime - remind_before).timestamp() for c in courses},
+    )
+
+
+async def cancel_reminder(course_id):
+    await cancel_reminders([course_id])
+
+
+async def cancel_reminders(course_ids: t.Iterable):
+    await redis.zrem(REMINDER_QUEUE_KEY, *[str(course_id) for course_id in course_ids])
+
+
+async def send_reminders(course_ids: t.List[str]):
+    courses = (
+        await Course.objects.select_related("teacher")
+        .filter(id__in=[UUID(course_id) for course_id in course_ids])
+        .all()
+    )
+    for c in courses:
+        for channel in reminder_channels:
+            try:
+                await channel(c)
+            except Exception:
+                traceback.print_exc()
+
+
+async def drain_reminders() -> int:
+    """Send every reminder that is due, one batch at a time."""
+    total = 0
+    while True:
+        due: t.List[str] = await claim_script(
+            keys=[REMINDER_QUEUE_KEY],
+            args=[time.time(), settings.reminder_batch_size],
+        )
+        if due:
+            await send_reminders(due)
+
+        total += len(due)
+        if len(due) < settings.reminder_batch_size:
+            return total
+
+
+async def reminder_loop():
+    while True:
+        try:
+            await drain_reminders()
+
+            # Wake up early if the next reminder is due before the next poll
+            delay: float = settings.reminder_poll_interval
+            upcoming = await redis.zrange(REMINDER_QUEUE_KEY, 0, 0, withscores=True)
+            if upcoming:
+                delay = min(delay, max(upcoming[0][1] - time.time(), 0))
+        except Exception:
+            traceback.print_exc()
+            delay = settings.reminder_poll_interval
+
+        await asyncio.sleep(delay)
@@ -0,0 +1,82 @@
+import re
+import typing as t
+from uuid import UUID
+
+from fastapi import HTTPException
+
+from ta_backend.helper.database import database
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Postgres keeps a weighted tsvector column in sync through a trigger and
+# indexes it with GIN, see migration 3f1b2c9d8e7a.
+POSTGRES_QUERY = """
+SELECT id FROM courses
+WHERE search_vector @@ to_tsquery('simple', :query){filters}
+ORDER BY ts_rank(search_vector, to_tsquery('simple', :query)) DESC, datetime DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# SQLite mirrors the searchable columns into an FTS5 table, also kept in
+# sync with triggers. Column weights follow the Postgres setweight() order.
+SQLITE_QUERY = """
+SELECT courses.id FROM courses_fts
+JOIN courses ON courses.id = courses_fts.course_id
+WHERE courses_fts MATCH :query{filters}
+ORDER BY bm25(courses_fts, 0.0, 10.0, 5.0, 1.0), courses.datetime DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+def _tokenize(query: str) -> t.List[str]:
+    return TOKEN_RE.findall(query.lower())
+
+
+def _postgres_query(tokens: t.List[str]) -> str:
+    return " & ".join(f"{token}:*" for token in tokens)
+
+
+def _sqlite_query(tokens: t.List[str]) -> str:
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+async def search_course_ids(
+    query: str,
+    matkul: t.Optional[str] = None,
+    include_hidden: bool = False,
+    page: int = 1,
+    page_size: int = 10,
+) -> t.List[UUID]:
+    """Return IDs of courses matching query, best match first.
+
+    Every token is treated as a prefix, so partial words still match
+    while the user is typing."""
+    tokens = _tokenize(query)
+    if not tokens:
+        return []
+
+    filters = ""
+    values: t.Dict[str, t.Any] = {
+        "limit": page_size,
+        "offset": (page - 1) * page_size,
+    }
+    if not include_hidden:
+        filters += " AND NOT courses.hidden"
+    if matkul:
+        filters += " AND courses.matkul = :matkul"
+        values["matkul"] = matkul
+
+    if database.url.dialect == "postgresql":
+        sql = POSTGRES_QUERY.format(filters=filters)
+        values["query"] = _postgres_query(tokens)
+    elif database.url.dialect == "sqlite":
+        sql = SQLITE_QUERY.format(filters=filters)
+        values["query"] = _sqlite_query(tokens)
+    else:
+        raise HTTPException(
+            status_code=501,
+            detail=f"Full-text search is not supported on {database.url.dialect}.",
+        )
+
+    rows = await database.fetch_all(sql, values)
+    return [UUID(str(row[0])) for row in rows]
@@ -9,5 +9,32 @@ class Settings(BaseSettings):
     sentry_url: str = ""
     discord_url: str = ""
 
+    # Seconds before a Redis call is given up, and before trying Redis
+    # again after it failed
+    redis_timeout: float = 0.25
+    redis_reset_timeout: int = 10
+    redis_flush_timeout: int = 5
+
+    # Upcoming courses preloaded into the cache when a worker starts
+    warmup_concurrency: int = 4
+    warmup_batch_size: int = 100
+
+    # Keep sessions in Redis instead of JWT cookies
+    session_mode: bool = False
+    session_ttl: int = 24 * 60 * 60
+
+    # Courses older than this many days are moved to the archive tables
+    archive_after_days: int = 30
+    archive_interval: int = 60 * 60
+    archive_batch_size: int = 500
+
+    # Seconds between rebuilds of the stats counters from the database
+    stats_reconcile_interval: int = 60 * 60
+
+    # Minutes before a course starts to send its reminder
+    reminder_before: int = 30
+    reminder_poll_interval: int = 30
+    reminder_batch_size: int = 100
+
 
 settings = Settings(".env")
@@ -0,0 +1,273 @@
+import asyncio
+import traceback
+import typing as t
+from collections import defaultdict
+
+import sqlalchemy
+
+from ta_backend.helper.circuit import RedisUnavailable
+from ta_backend.helper.database import database
+from ta_backend.helper.settings import settings
+from ta_backend.models import ArchivedCourse, Course, Subject, User
+from ta_backend.plugins import redis
+
+STATS_LOCK_KEY = "stats--lock"
+TOTAL_STATS_KEY = "stats--total"
+LEADERBOARDS = ("students", "courses")
+
+# Fields of every stats hash. capacity sums the limits of limited courses,
+# and seated counts the students of those same courses, so their ratio is
+# the fill rate.
+STATS_FIELDS = ("courses", "students", "capacity", "seated")
+
+
+def teacher_stats_key(npm: int) -> str:
+    return f"{npm}--teacher-stats"
+
+
+def subject_stats_key(matkul: str) -> str:
+    return f"{matkul}--subject-stats"
+
+
+def leaderboard_key(by: str) -> str:
+    return f"stats--teachers-by-{by}"
+
+
+def _stats_keys(teacher_npm: int, matkul: str) -> t.List[str]:
+    return [TOTAL_STATS_KEY, teacher_stats_key(teacher_npm), subject_stats_key(matkul)]
+
+
+async def _execute_tracking(pipe):
+    try:
+        await pipe.execute()
+    except RedisUnavailable:
+        # Counters miss this change until the next reconcile_stats run
+        pass
+
+
+def _add_course(
+    pipe,
+    teacher: User,
+    matkul: str,
+    students_limit: t.Optional[int],
+    students: int,
+    sign: int,
+):
+    values = {"courses": sign, "students": sign * students}
+    if students_limit:
+        values["capacity"] = sign * students_limit
+        values["seated"] = sign * students
+
+    for key in _stats_keys(teacher.npm, matkul):
+        for field, amount in values.items():
+            pipe.hincrby(key, field, amount)
+    pipe.hset(teacher_stats_key(teacher.npm), "name", teacher.name)
+    pipe.zincrby(leaderboard_key("courses"), sign, str(teacher.npm))
+    pipe.zincrby(leaderboard_key("students"), sign * students, str(teacher.npm))
+
+
+async def track_courses(
+    courses: t.Iterable[Course],
+    students_counts: t.Optional[t.Dict] = None,
+    removed: bool = False,
+):
+    """Count courses in, or out when removed. students_counts maps course
+    ids to their number of students, missing ones have none."""
+    students_counts = students_counts or {}
+    pipe = redis.pipeline(transaction=False)
+    for c in courses:
+        _add_course(
+            pipe,
+            c.teacher,
+            c.matkul,
+            c.students_limit,
+            students_counts.get(c.id, 0),
+            -1 if removed else 1,
+        )
+    await _execute_tracking(pipe)
+
+
+async def track_course_change(
+    course: Course,
+    old_matkul: str,
+    old_students_limit: t.Optional[int],
+    students: int,
+):
+    """Move the numbers of a course whose subject or limit changed."""
+    await track_course_changes(
+        [course],
+        {course.id: (old_matkul, old_students_limit)},
+        {course.id: students},
+    )
+
+
+async def track_course_changes(
+    courses: t.Iterable[Course],
+    old_values: t.Dict,
+    students_counts: t.Optional[t.Dict] = None,
+):
+    """Same as track_course_change for many courses in one round trip.
+    old_values maps course ids to their previous (matkul, students_limit),
+    students_counts is the same as for track_courses."""
+    students_counts = students_counts or {}
+    pipe = redis.pipeline(transaction=False)
+    changed = False
+    for c in courses:
+        old_matkul, old_students_limit = old_values[c.id]
+        if (old_matkul, old_students_limit) == (c.matkul, c.students_limit):
+            continue
+
+        students = students_counts.get(c.id, 0)
+        _add_course(pipe, c.teacher, old_matkul, old_students_limit, students, -1)
+        _add_course(pipe, c.teacher, c.matkul, c.students_limit, students, 1)
+        changed = True
+
+    if changed:
+        await _execute_tracking(pipe)
+
+
+async def track_enrollments(course: Course, delta: int):
+    """Count delta students in (or out, when negative) of course."""
+    if not delta:
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for key in _stats_keys(course.teacher.npm, course.matkul):
+        pipe.hincrby(key, "students", delta)
+        if course.students_limit:
+            pipe.hincrby(key, "seated", delta)
+    pipe.zincrby(leaderboard_key("students"), delta, str(course.teacher.npm))
+    await _execute_tracking(pipe)
+
+
+def _to_stats(stats_hash: t.Dict[str, str]) -> t.Dict:
+    values = {field: int(stats_hash.get(field, 0)) for field in STATS_FIELDS}
+    return {
+        "courses": values["courses"],
+        "students": values["students"],
+        "fill_rate": values["seated"] / values["capacity"]
+        if values["capacity"]
+        else None,
+    }
+
+
+async def get_stats() -> t.Dict:
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(TOTAL_STATS_KEY)
+    for subject in Subject:
+        pipe.hgetall(subject_stats_key(subject.value))
+    total, *subjects = await pipe.execute()
+
+    return {
+        "total": _to_stats(total),
+        "subjects": {
+            subject.name: _to_stats(stats_hash)
+            for subject, stats_hash in zip(Subject, subjects)
+        },
+    }
+
+
+async def get_leaderboard(by: str, limit: int) -> t.List[t.Dict]:
+    """Top teachers by one of LEADERBOARDS, costs a read per entry."""
+    top = await redis.zrange(leaderboard_key(by), 0, limit - 1, desc=True)
+
+    pipe = redis.pipeline(transaction=False)
+    for npm in top:
+        pipe.hgetall(teacher_stats_key(int(npm)))
+    stats_hashes = await pipe.execute()
+
+    return [
+        {"npm": int(npm), "name": stats_hash.get("name", ""), **_to_stats(stats_hash)}
+        for npm, stats_hash in zip(top, stats_hashes)
+    ]
+
+
+def _aggregate_query(table: sqlalchemy.Table, students):
+    users = User.Meta.table
+    limited = table.c.students_limit != None  # noqa
+    return sqlalchemy.select(
+        [
+            table.c.teacher,
+            users.c.name,
+            table.c.matkul,
+            sqlalchemy.func.count(),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(students), 0),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(table.c.students_limit), 0),
+            sqlalchemy.func.coalesce(
+                sqlalchemy.func.sum(sqlalchemy.case((limited, students), else_=0)), 0
+            ),
+        ]
+    ).group_by(table.c.teacher, users.c.name, table.c.matkul)
+
+
+async def reconcile_stats():
+    """Rebuild every counter from the live and archived courses. Increments
+    that land while this runs may be lost, the next run picks them up."""
+    courses = Course.Meta.table
+    archived = ArchivedCourse.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    users = User.Meta.table
+
+    counts = (
+        sqlalchemy.select(
+            [enrollments.c.course, sqlalchemy.func.count().label("students")]
+        )
+        .group_by(enrollments.c.course)
+        .subquery()
+    )
+    # Courses without students have no count, SUM skips them
+    live_query = _aggregate_query(courses, counts.c.students).select_from(
+        courses.join(users, users.c.npm == courses.c.teacher).outerjoin(
+            counts, counts.c.course == courses.c.id
+        )
+    )
+    archive_query = _aggregate_query(archived, archived.c.students_count).select_from(
+        archived.join(users, users.c.npm == archived.c.teacher)
+    )
+    rows = [
+        *await database.fetch_all(live_query),
+        *await database.fetch_all(archive_query),
+    ]
+
+    stats: t.Dict[str, t.Dict[str, int]] = defaultdict(
+        lambda: dict.fromkeys(STATS_FIELDS, 0)
+    )
+    names: t.Dict[int, str] = {}
+    for row in rows:
+        npm, name, matkul = row[0], row[1], row[2]
+        names[npm] = name
+        for key in _stats_keys(npm, matkul):
+            for i, field in enumerate(STATS_FIELDS):
+                stats[key][field] += int(row[3 + i])
+
+    old_teachers = await redis.zrange(leaderboard_key("courses"), 0, -1)
+    pipe = redis.pipeline(transaction=True)
+    pipe.delete(
+        TOTAL_STATS_KEY,
+        *[subject_stats_key(subject.value) for subject in Subject],
+        *[teacher_stats_key(int(npm)) for npm in old_teachers],
+        *[leaderboard_key(by) for by in LEADERBOARDS],
+    )
+    for key, values in stats.items():
+        pipe.hset(key, mapping=values)
+    for npm, name in names.items():
+        values = stats[teacher_stats_key(npm)]
+        pipe.hset(teacher_stats_key(npm), "name", name)
+        for by in LEADERBOARDS:
+            pipe.zadd(leaderboard_key(by), {str(npm): values[by]})
+    await pipe.execute()
+
+
+async def stats_loop():
+    """Periodically correct drift of the counters. Only one worker runs the
+    job in each interval, the others skip it while the lock is held."""
+    while True:
+        try:
+            if await redis.set(
+                STATS_LOCK_KEY, 1, nx=True, ex=settings.stats_reconcile_interval
+            ):
+                await reconcile_stats()
+        except Exception:
+            traceback.print_exc()
+
+        await asyncio.sleep(settings.stats_reconcile_interval)
@@ -0,0 +1,93 @@
+import asyncio
+import time
+import typing as t
+
+from ta_backend.helper.database import database
+from ta_backend.models import Course, User
+from ta_backend.plugins import redis
+
+PROMOTE_LOCK_TIMEOUT = 10
+PROMOTE_POLL_INTERVAL = 0.1
+
+
+def waitlist_key(course_id) -> str:
+    return f"{str(course_id)}--waitlist"
+
+
+async def join_waitlist(course: Course, npm: int) -> int:
+    """Queue user for a seat and return their 1-based position. Joining
+    again keeps the original place in line."""
+    key = waitlist_key(course.id)
+    pipe = redis.pipeline(transaction=True)
+    pipe.zadd(key, {str(npm): time.time()}, nx=True)
+    # Nobody can be promoted once the course started
+    pipe.expireat(key, int(course.datetime.timestamp()))
+    pipe.zrank(key, str(npm))
+    *_, rank = await pipe.execute()
+    return rank + 1
+
+
+async def leave_waitlist(course_id, npm: int) -> bool:
+    return bool(await redis.zrem(waitlist_key(course_id), str(npm)))
+
+
+async def delete_waitlists(course_ids: t.Iterable):
+    keys = [waitlist_key(course_id) for course_id in course_ids]
+    if keys:
+        await redis.delete(*keys)
+
+
+async def waitlist_position(course_id, npm: int) -> t.Optional[int]:
+    rank = await redis.zrank(waitlist_key(course_id), str(npm))
+    return None if rank is None else rank + 1
+
+
+async def promote_waitlist(course: Course) -> t.List[int]:
+    """Enroll users from the head of the waitlist until the course is full.
+    Returns NPM of the promoted users.
+
+    Entries are popped atomically, then checked against the database, since
+    the queue may still hold users that enrolled or left in the meantime.
+    When another promotion is running this waits for it, as it may have
+    checked the capacity before the seat that triggered this call freed."""
+    key = waitlist_key(course.id)
+    lock_key = f"{str(course.id)}--promote-lock"
+    waited = 0.0
+    while not await redis.set(lock_key, 1, nx=True, ex=PROMOTE_LOCK_TIMEOUT):
+        # A lock taken before the seat freed has expired by now, whoever
+        # holds it took it later and sees the seat
+        if waited >= PROMOTE_LOCK_TIMEOUT:
+            return []
+        await asyncio.sleep(PROMOTE_POLL_INTERVAL)
+        waited += PROMOTE_POLL_INTERVAL
+
+    promoted: t.List[int] = []
+    try:
+        while True:
+            students_count: int = await course.students.count()  # type: ignore
+            if course.students_limit and students_count >= course.students_limit:
+                break
+
+            popped = await redis.zpopmin(key)
+            if not popped:
+                break
+            member, score = popped[0]
+
+            try:
+                async with database.transaction():
+                    user = await User.objects.get_or_none(npm=int(member))
+                    if not user or user.npm == course.teacher.npm:
+                        continue
+                    if await course.students.filter(npm=user.npm).exists():
+                        continue
+                    await course.students.add(user)
+            except Exception:
+                # Give the seat back to the same user on the next try
+                await redis.zadd(key, {member: score})
+                raise
+
+            promoted.append(user.npm)
+    finally:
+        await redis.delete(lock_key)
+
+    return promoted
@@ -38,6 +38,30 @@ class User(ormar.Model):
     if TYPE_CHECKING:
         courses_taken: QuerysetProxy["Course"]
         courses_owned: QuerysetProxy["Course"]
+        archived_courses_taken: QuerysetProxy["ArchivedEnrollment"]
+        archived_courses_owned: QuerysetProxy["ArchivedCourse"]
+        series_owned: QuerysetProxy["CourseSeries"]
+
+
+class CourseSeries(ormar.Model):
+    """Recurring course, every occurrence is a Course of its own."""
+
+    class Meta(BaseMeta):
+        tablename = "course_series"
+
+    id: ormar.UUID = ormar.UUID(primary_key=True, default=uuid.uuid4)
+    name: str = ormar.String(max_length=100)
+    matkul: str = ormar.String(max_length=25, choices=list(Subject))
+    starts_at: dt = ormar.DateTime(timezone=True)
+    interval_days: int = ormar.Integer()
+    occurrences: int = ormar.Integer()
+    link: str = ormar.Text(nullable=True)
+    students_limit = ormar.Integer(nullable=True)
+    notes: str = ormar.Text(nullable=True)
+    notes_short: str = ormar.String(max_length=100, nullable=True)
+    hidden: bool = ormar.Boolean(default=False)
+
+    teacher = ormar.ForeignKey(User, related_name="series_owned", nullable=False)
 
 
 class Course(ormar.Model):
@@ -56,3 +80,52 @@ class Course(ormar.Model):
 
     teacher = ormar.ForeignKey(User, related_name="courses_owned", nullable=False)
     students = ormar.ManyToMany(User, related_name="courses_taken")
+    series = ormar.ForeignKey(
+        CourseSeries,
+        related_name="courses",
+        nullable=True,
+        ondelete="SET NULL",
+    )
+
+
+class ArchivedCourse(ormar.Model):
+    """Past course moved out of the courses table by the archive job.
+    Students count is frozen at archive time."""
+
+    class Meta(BaseMeta):
+        tablename = "courses_archive"
+
+    id: ormar.UUID = ormar.UUID(primary_key=True)
+    name: str = ormar.String(max_length=100)
+    matkul: str = ormar.String(max_length=25, choices=list(Subject))
+    datetime: dt = ormar.DateTime(name="datetime", timezone=True)
+    link: str = ormar.Text(nullable=True)
+    students_limit = ormar.Integer(nullable=True)
+    notes: str = ormar.Text(nullable=True)
+    notes_short: str = ormar.String(max_length=100, nullable=True)
+    hidden: bool = ormar.Boolean(default=False)
+    students_count: int = ormar.Integer(default=0)
+    archived_at: dt = ormar.DateTime(timezone=True)
+
+    teacher = ormar.ForeignKey(
+        User,
+        related_name="archived_courses_owned",
+        nullable=False,
+    )
+
+
+class ArchivedEnrollment(ormar.Model):
+    class Meta(BaseMeta):
+        tablename = "courses_users_archive"
+
+    id: int = ormar.Integer(primary_key=True)
+    course = ormar.ForeignKey(
+        ArchivedCourse,
+        related_name="enrollments",
+        ondelete="CASCADE",
+    )
+    user = ormar.ForeignKey(
+        User,
+        related_name="archived_courses_taken",
+        ondelete="CASCADE",
+    )
@@ -1,21 +1,181 @@
 import aioredis
+import secrets
+import typing as t
 from datetime import timedelta
 
+import ujson
 from fastapi_login import LoginManager
 
+from ta_backend.helper.circuit import ResilientRedis
 from ta_backend.helper.settings import settings
 from ta_backend.models import User
 
-manager = LoginManager(
+PRINCIPAL_CACHE_TTL = 10 * 60
+
+# Keys that only hold cached data, dropped when Redis comes back after an
+# outage. Version counters are included, they restart from the current time.
+CACHE_KEY_PATTERNS = [
+    "catalog--version",
+    "facets--*",
+    "*--detail",
+    "*--version",
+    "*--courses-version",
+    "*--principal",
+    "*--calendar",
+    "*--vevent",
+]
+
+# Reads the session and its user's principal, and slides the session
+# expiry, in a single round trip. Principal key matches principal_key().
+LOAD_SESSION_SCRIPT = """
+local npm = redis.call('HGET', KEYS[1], 'npm')
+if not npm then
+    return false
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return {npm, redis.call('GET', npm .. '--principal')}
+"""
+
+
+class SessionLoginManager(LoginManager):
+    """LoginManager that can keep sessions server side. With session_mode
+    enabled the cookie holds a random session ID instead of a JWT, so
+    authenticating costs one Redis call and no signature check, and a
+    session is revoked by deleting its key."""
+
+    async def get_current_user(self, token: str):
+        if not settings.session_mode:
+            return await super().get_current_user(token)
+
+        user = await load_session(token)
+        if user is None:
+            raise self.not_authenticated_exception
+        return user
+
+
+manager = SessionLoginManager(
     settings.secret,
     "/auth/login",
     use_cookie=True,
     use_header=False,
     default_expiry=timedelta(hours=24),
 )
-redis = aioredis.from_url(settings.redis_url, encoding="utf-8", decode_responses=True)
+redis = ResilientRedis(
+    aioredis.from_url(
+        settings.redis_url,
+        encoding="utf-8",
+        decode_responses=True,
+        socket_connect_timeout=settings.redis_timeout,
+    ),
+    timeout=settings.redis_timeout,
+    reset_timeout=settings.redis_reset_timeout,
+    flush_timeout=settings.redis_flush_timeout,
+    cache_patterns=CACHE_KEY_PATTERNS,
+)
+load_session_script = redis.register_script(LOAD_SESSION_SCRIPT)
+
+
+def principal_key(npm: int) -> str:
+    return f"{npm}--principal"
+
+
+def session_key(session_id: str) -> str:
+    return f"{session_id}--session"
+
+
+def user_sessions_key(npm: int) -> str:
+    return f"{npm}--sessions"
+
+
+async def cache_principal(user: User):
+    """Cache what authenticated routes need from a user: the profile and
+    the IDs of their courses. It is dropped whenever the user's course set
+    changes, see helper.cache.invalidate_courses."""
+    principal = {
+        "npm": user.npm,
+        "username": user.username,
+        "name": user.name,
+        "is_admin": user.is_admin,
+        "courses_taken": [str(c.id) for c in user.courses_taken],
+        "courses_owned": [str(c.id) for c in user.courses_owned],
+    }
+    await redis.set(
+        principal_key(user.npm),
+        ujson.dumps(principal),
+        ex=PRINCIPAL_CACHE_TTL,
+    )
+
+
+async def get_cached_principal(npm: int) -> t.Optional[User]:
+    principal_json: str = await redis.get(principal_key(npm))
+    if not principal_json:
+        return None
+
+    # Courses are only known by their primary key, which is all that is
+    # needed to check ownership and enrollment.
+    return User(**ujson.loads(principal_json))
 
 
 @manager.user_loader()  # type: ignore
 async def get_user(identifier):
-    return await User.objects.select_all().get_or_none(**identifier)
+    user = await get_cached_principal(identifier["npm"])
+    if user and user.username == identifier["username"]:
+        return user
+
+    user = await User.objects.select_all().get_or_none(**identifier)
+    if user:
+        await cache_principal(user)
+    return user
+
+
+async def create_session(user: User) -> str:
+    session_id = secrets.token_urlsafe(32)
+    sessions_key = user_sessions_key(user.npm)
+
+    # Forget sessions that have expired since the last login
+    old_sessions: t.Set[str] = await redis.smembers(sessions_key)
+    pipe = redis.pipeline(transaction=False)
+    for old_session in old_sessions:
+        pipe.exists(session_key(old_session))
+    alive = await pipe.execute()
+
+    pipe = redis.pipeline(transaction=True)
+    pipe.hset(
+        session_key(session_id),
+        mapping={"npm": user.npm, "username": user.username},
+    )
+    pipe.expire(session_key(session_id), settings.session_ttl)
+    pipe.sadd(sessions_key, session_id)
+    expired = [sid for sid, exists in zip(old_sessions, alive) if not exists]
+    if expired:
+        pipe.srem(sessions_key, *expired)
+    await pipe.execute()
+    return session_id
+
+
+async def load_session(session_id: str) -> t.Optional[User]:
+    result = await load_session_script(
+        keys=[session_key(session_id)],
+        args=[settings.session_ttl],
+    )
+    if not result:
+        return None
+
+    npm, principal_json = result
+    if principal_json:
+        return User(**ujson.loads(principal_json))
+
+    user = await User.objects.select_all().get_or_none(npm=int(npm))
+    if user:
+        await cache_principal(user)
+    return user
+
+
+async def revoke_session(session_id: str):
+    await redis.delete(session_key(session_id))
+
+
+async def revoke_user_sessions(npm: int):
+    sessions_key = user_sessions_key(npm)
+    session_ids: t.Set[str] = await redis.smembers(sessions_key)
+    await redis.delete(sessions_key, *map(session_key, session_ids))
@@ -27,6 +27,30 @@ class CourseDetailReponse(CourseResponse):
     notes: t.Optional[str]
 
 
+class WaitlistResponse(BaseModel):
+    position: t.Optional[int]
+
+
+class CalendarResponse(BaseModel):
+    url: str
+
+
+class StatsEntry(BaseModel):
+    courses: int
+    students: int
+    fill_rate: t.Optional[float]
+
+
+class StatsResponse(BaseModel):
+    total: StatsEntry
+    subjects: t.Dict[str, StatsEntry]
+
+
+class LeaderboardEntry(StatsEntry):
+    npm: int
+    name: str
+
+
 class UserResponse(BaseModel):
     npm: int
     username: str
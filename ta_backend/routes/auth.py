@@ -1,14 +1,54 @@
 from black import traceback
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from sqlalchemy.dialects import postgresql, sqlite
 
+from ta_backend.helper.database import database
 from ta_backend.helper.settings import settings
 from ta_backend.models import User
-from ta_backend.plugins import manager
+from ta_backend.plugins import (
+    cache_principal,
+    create_session,
+    manager,
+    revoke_session,
+    revoke_user_sessions,
+)
+from ta_backend.responses import DefaultResponse
 from ta_backend.sso.client import AuthError, UIClient
 
 router = APIRouter(prefix="/auth")
 client = UIClient(f"http://{settings.hostname}/auth/callback")
+upsert_dialects = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+async def _upsert_user(npm: int, username: str, name: str) -> User:
+    """Create the user, or update their name, with a single statement.
+    The row is only written when the name actually changed."""
+    insert = upsert_dialects.get(database.url.dialect)
+    if insert:
+        table = User.Meta.table
+        query = insert(table).values(
+            npm=npm,
+            username=username,
+            name=name,
+            is_admin=False,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[table.c.npm],
+            set_={"name": query.excluded.name},
+            where=table.c.name.is_distinct_from(query.excluded.name),
+        )
+        await database.execute(query)
+    else:
+        user = await User.objects.get_or_create(npm=npm, username=username)
+        if user.name != name:
+            await user.update(name=name)
+
+    # Courses are loaded too, so the principal cache can be warmed
+    return await User.objects.select_all().get(npm=npm)
 
 
 @router.get("/login")
@@ -33,29 +73,49 @@ async def callback(ticket: str = Query(...)):
             detail="This service is only available for Faculty of Computer Science students.",
         )
 
-    user = await User.objects.get_or_create(
-        npm=sso_response["attributes"]["npm"],
+    user = await _upsert_user(
+        npm=int(sso_response["attributes"]["npm"]),
         username=sso_response["username"].lower(),
+        name=sso_response["attributes"]["nama"],
     )
-    await user.update(name=sso_response["attributes"]["nama"])
+    await cache_principal(user)
 
     response = HTMLResponse(
         content="""<script>window.opener.postMessage("logged", "*")</script>"""
     )
-    token = manager.create_access_token(
-        data=dict(
-            sub=dict(
-                npm=user.npm,
-                username=user.username,
+    if settings.session_mode:
+        token = await create_session(user)
+    else:
+        token = manager.create_access_token(
+            data=dict(
+                sub=dict(
+                    npm=user.npm,
+                    username=user.username,
+                )
             )
         )
-    )
     manager.set_cookie(response, token)
     return response
 
 
 @router.get("/logout")
-async def logout(user: User = Depends(manager)):
+async def logout(request: Request, user: User = Depends(manager)):
+    if settings.session_mode:
+        await revoke_session(request.cookies[manager.cookie_name])
+
     response = JSONResponse(content={"message": "Logged out."})
     response.set_cookie("access-token")
     return response
+
+
+@router.post("/revoke/{npm}", response_model=DefaultResponse)
+async def revoke(npm: int, user: User = Depends(manager)):
+    if not user.is_admin:
+        raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+    if not settings.session_mode:
+        raise HTTPException(
+            status_code=400, detail="Sessions are not stored in this mode."
+        )
+
+    await revoke_user_sessions(npm)
+    return {"message": "Sessions revoked."}
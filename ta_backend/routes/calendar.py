@@ -0,0 +1,143 @@
+import typing as t
+from uuid import UUID
+
+import ujson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from ta_backend.helper.cache import (
+    course_version_key,
+    get_versions,
+    is_not_modified,
+    make_etag,
+    user_courses_version_key,
+)
+from ta_backend.helper.calendar import (
+    CALENDAR_FOOTER,
+    CALENDAR_HEADER,
+    calendar_token,
+    parse_calendar_token,
+    render_event,
+)
+from ta_backend.helper.settings import settings
+from ta_backend.models import Course, User
+from ta_backend.plugins import manager, redis
+from ta_backend.responses import CalendarResponse
+
+CALENDAR_CACHE_TTL = 7 * 24 * 60 * 60
+
+router = APIRouter(prefix="/calendar")
+
+
+def _event_key(course_id: str) -> str:
+    return f"{course_id}--vevent"
+
+
+async def _load_course_ids(npm: int) -> t.List[str]:
+    taken = await Course.objects.filter(Course.students.npm == npm).values_list(
+        "id", flatten=True
+    )
+    owned = await Course.objects.filter(Course.teacher.npm == npm).values_list(
+        "id", flatten=True
+    )
+    return [str(course_id) for course_id in {*taken, *owned}]
+
+
+async def _load_events(
+    course_ids: t.List[str],
+    course_versions: t.List[str],
+) -> t.List[str]:
+    """Get VEVENT of every course, rendering only the ones that changed
+    since they were cached."""
+    cached = await redis.mget(*map(_event_key, course_ids))
+
+    events: t.Dict[str, str] = {}
+    stale: t.Dict[str, str] = {}
+    for course_id, version, event_json in zip(course_ids, course_versions, cached):
+        event = ujson.loads(event_json) if event_json else None
+        if event and event["version"] == version:
+            events[course_id] = event["body"]
+        else:
+            stale[course_id] = version
+
+    if stale:
+        courses = (
+            await Course.objects.select_related("teacher")
+            .filter(id__in=[UUID(course_id) for course_id in stale])
+            .all()
+        )
+        for c in courses:
+            events[str(c.id)] = render_event(c)
+
+        pipe = redis.pipeline(transaction=False)
+        for course_id, version in stale.items():
+            # Deleted courses are cached as empty events, so they are not
+            # looked up again until the user's course set is reloaded.
+            body = events.setdefault(course_id, "")
+            pipe.set(
+                _event_key(course_id),
+                ujson.dumps({"version": version, "body": body}),
+                ex=CALENDAR_CACHE_TTL,
+            )
+        await pipe.execute()
+
+    return [events[course_id] for course_id in course_ids]
+
+
+@router.get("/token", response_model=CalendarResponse)
+async def calendar_subscribe(user: User = Depends(manager)):
+    token = calendar_token(user.npm)
+    return {"url": f"http://{settings.hostname}/calendar/{token}.ics"}
+
+
+@router.get("/{token}.ics")
+async def calendar_feed(token: str, request: Request):
+    npm = parse_calendar_token(token)
+    if npm is None:
+        raise HTTPException(status_code=404, detail="Calendar not found!")
+
+    redis_key = f"{npm}--calendar"
+    user_key = user_courses_version_key(npm)
+
+    # The set of courses only has to be fetched again when the user
+    # enrolled, unenrolled or created a course.
+    course_ids: t.Optional[t.List[str]] = None
+    snapshot_json: str = await redis.get(redis_key)
+    if snapshot_json:
+        snapshot = ujson.loads(snapshot_json)
+        user_version, *course_versions = await get_versions(
+            user_key, *map(course_version_key, snapshot["courses"])
+        )
+        if user_version == snapshot["version"]:
+            course_ids = snapshot["courses"]
+
+    if course_ids is None:
+        # Versions are read before the database, so a write racing with
+        # this request leaves a stale version behind instead of stale data.
+        (user_version,) = await get_versions(user_key)
+        course_ids = await _load_course_ids(npm)
+        course_versions = []
+        if course_ids:
+            course_versions = await get_versions(*map(course_version_key, course_ids))
+        await redis.set(
+            redis_key,
+            ujson.dumps({"version": user_version, "courses": course_ids}),
+            ex=CALENDAR_CACHE_TTL,
+        )
+
+    etag = make_etag("calendar", user_version, *course_ids, *course_versions)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    events = await _load_events(course_ids, course_versions) if course_ids else []
+
+    def calendar_stream():
+        yield CALENDAR_HEADER
+        yield from events
+        yield CALENDAR_FOOTER
+
+    return StreamingResponse(
+        calendar_stream(),
+        media_type="text/calendar",
+        headers={"ETag": etag},
+    )
@@ -1,3 +1,4 @@
+import asyncio
 import re
 import typing as t
 import urllib.parse
@@ -6,18 +7,79 @@ from uuid import UUID
 
 import ujson
 import pytz
-from fastapi import APIRouter, Depends, HTTPException, Query
+import sqlalchemy
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi_limiter.depends import RateLimiter
-from pydantic import BaseModel
+from ormar import QuerySet
+from pydantic import BaseModel, Field
 
-from ta_backend.models import Course, Subject, User
+from ta_backend.models import ArchivedCourse, Course, CourseSeries, Subject, User
 from ta_backend.plugins import manager, redis
-from ta_backend.responses import CourseDetailReponse, CourseResponse, DefaultResponse
-from ta_backend.helper.discord import send_webhook
+from ta_backend.responses import (
+    CourseDetailReponse,
+    CourseResponse,
+    DefaultResponse,
+    WaitlistResponse,
+)
+from ta_backend.helper.cache import (
+    CATALOG_VERSION_KEY,
+    course_detail_key,
+    course_version_key,
+    get_versions,
+    invalidate_course,
+    invalidate_courses,
+    is_not_modified,
+    make_etag,
+)
+from ta_backend.helper.circuit import best_effort
+from ta_backend.helper.database import database
+from ta_backend.helper.discord import send_series_webhook, send_webhook
+from ta_backend.helper.export import (
+    EXPORT_FORMAT_REGEX,
+    EXPORT_MEDIA_TYPES,
+    stream_export,
+)
+from ta_backend.helper.events import course_events, publish_course_event
+from ta_backend.helper.idempotency import IdempotentRateLimiter, run_idempotent
+from ta_backend.helper.reminders import (
+    cancel_reminder,
+    cancel_reminders,
+    schedule_reminder,
+    schedule_reminders,
+)
+from ta_backend.helper.search import search_course_ids
+from ta_backend.helper.waitlist import (
+    delete_waitlists,
+    join_waitlist,
+    leave_waitlist,
+    promote_waitlist,
+    waitlist_position,
+)
 from ta_backend.helper.settings import settings
+from ta_backend.helper.stats import (
+    track_course_change,
+    track_course_changes,
+    track_courses,
+    track_enrollments,
+)
 
 jkt_timezone = timezone(timedelta(hours=7))
 
+FACETS_ADMIN_KEY = "facets--admin"
+FACETS_PUBLIC_KEY = "facets--public"
+FACETS_CACHE_TTL = 60
+WARMUP_CACHE_TTL = 60
+# A teacher may have MAX_UPCOMING_CLASSES upcoming single classes and, on
+# top of them, MAX_UPCOMING_SERIES series that still have upcoming sessions.
+# Sessions of a series do not count toward the classes quota, the series
+# cap bounds them instead, since a series alone already exceeds it.
+MAX_UPCOMING_CLASSES = 2
+MAX_UPCOMING_SERIES = 1
+STREAM_KEEPALIVE = 15
+AVAILABLE_ETAG_WINDOW = 60
+BULK_MAX_ITEMS = 500
+
 
 class CourseCreate(BaseModel):
     name: str
@@ -35,6 +97,38 @@ class CourseCreate(BaseModel):
         super().__init__(*args, **kwargs)
 
 
+class CourseSeriesCreate(CourseCreate):
+    interval_days: int = Field(7, ge=1, le=28)
+    occurrences: int = Field(..., ge=2, le=28)
+
+
+class CourseSeriesUpdate(BaseModel):
+    name: str
+    matkul: Subject
+    students_limit: t.Optional[int] = None
+    notes: t.Optional[str] = ""
+    link: t.Optional[str] = ""
+    notes_short: t.Optional[str] = ""
+    hidden: bool
+
+
+class CourseBulk(BaseModel):
+    course_ids: t.List[UUID] = Field(..., min_items=1, max_items=BULK_MAX_ITEMS)
+
+
+class CourseBulkVisibility(CourseBulk):
+    hidden: bool
+
+
+class CourseBulkMove(CourseBulk):
+    matkul: Subject
+
+
+class CourseBulkEnrollment(BaseModel):
+    course_id: UUID
+    npms: t.List[int] = Field(..., min_items=1, max_items=BULK_MAX_ITEMS)
+
+
 router = APIRouter(
     prefix="/course",
     dependencies=[
@@ -60,6 +154,10 @@ def _current_dt_aware():
     return datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(jkt_timezone)
 
 
+def _is_enrolled(course_id: UUID, user: User) -> bool:
+    return user.is_admin or any(c.id == course_id for c in user.courses_taken)
+
+
 def _can_fetch_details(course_id: UUID, user: User) -> bool:
     """Try to figure out if current used is a student or teacher
     WITHOUT calling database, as we already have the data from
@@ -81,9 +179,16 @@ def _can_fetch_details(course_id: UUID, user: User) -> bool:
     return is_student or is_teacher or user.is_admin
 
 
-async def _create_coursedict(course: Course, user: User):
-    response = course.dict(exclude={"datetime", "matkul", "teacher", "students"})
-    student_count: int = await course.students.count()  # type: ignore
+async def _create_coursedict(
+    course: Course,
+    user: User,
+    student_count: t.Optional[int] = None,
+):
+    response = course.dict(
+        exclude={"datetime", "matkul", "teacher", "students", "series"}
+    )
+    if student_count is None:
+        student_count = await course.students.count()  # type: ignore
 
     response.update(
         {
@@ -101,6 +206,180 @@ async def _create_coursedict(course: Course, user: User):
     return response
 
 
+async def _count_students(course_ids: t.Sequence[UUID]) -> t.Dict[UUID, int]:
+    """Count students of many courses in one query. Courses without
+    students are left out."""
+    if not course_ids:
+        return {}
+
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    rows = await database.fetch_all(
+        sqlalchemy.select([enrollments.c.course, sqlalchemy.func.count()])
+        .where(enrollments.c.course.in_(course_ids))
+        .group_by(enrollments.c.course)
+    )
+    return {row[0]: row[1] for row in rows}
+
+
+async def warm_course_cache(concurrency: int, batch_size: int) -> int:
+    """Preload detail caches and version counters of upcoming visible
+    courses, so the first polls a new worker gets do not all reach the
+    database. Returns the number of courses warmed."""
+    filters = (Course.datetime >= _current_dt_aware()) & (
+        Course.hidden == False  # noqa
+    )
+    courses = await Course.objects.filter(filters).select_related("teacher").all()
+    counts = await _count_students([c.id for c in courses])
+    await get_versions(CATALOG_VERSION_KEY)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm_batch(batch: t.List[Course]):
+        async with semaphore:
+            await get_versions(*[course_version_key(c.id) for c in batch])
+            pipe = redis.pipeline(transaction=False)
+            for c in batch:
+                course_dict = await _create_coursedict(
+                    c, c.teacher, counts.get(c.id, 0)
+                )
+                # A worker that is already serving may have cached it first.
+                # The snapshot may miss an invalidation that landed since it
+                # was read, so it expires soon and is refilled from the DB.
+                pipe.set(
+                    course_detail_key(c.id),
+                    ujson.dumps(course_dict),
+                    ex=WARMUP_CACHE_TTL,
+                    nx=True,
+                )
+            await pipe.execute()
+
+    await asyncio.gather(
+        *[
+            warm_batch(courses[i : i + batch_size])
+            for i in range(0, len(courses), batch_size)
+        ]
+    )
+    return len(courses)
+
+
+def _upcoming_filter(user: User, current_time: datetime):
+    table = Course.Meta.table
+    return (table.c.datetime > current_time) & (table.c.teacher == user.npm)
+
+
+async def _count_upcoming_classes(user: User, current_time: datetime) -> int:
+    """Count upcoming single classes of user, sessions of a series are left
+    out."""
+    table = Course.Meta.table
+    query = sqlalchemy.select([sqlalchemy.func.count()]).where(
+        _upcoming_filter(user, current_time) & (table.c.series == None)  # noqa
+    )
+    return await database.fetch_val(query)
+
+
+async def _count_upcoming_series(user: User, current_time: datetime) -> int:
+    """Count series of user that still have upcoming sessions."""
+    table = Course.Meta.table
+    query = sqlalchemy.select(
+        [sqlalchemy.func.count(sqlalchemy.distinct(table.c.series))]
+    ).where(_upcoming_filter(user, current_time))
+    return await database.fetch_val(query)
+
+
+def _create_archived_coursedict(course: ArchivedCourse, is_enrolled: bool):
+    response = course.dict(
+        exclude={"datetime", "matkul", "teacher", "enrollments", "archived_at"}
+    )
+    response.update(
+        {
+            "id": str(course.id),
+            "matkul": Subject(course.matkul).name,
+            "datetime": course.datetime.astimezone(jkt_timezone).strftime(
+                "%Y-%m-%dT%H:%M:%S"
+            ),
+            "teacher": course.teacher.name,
+            "teacher_npm": course.teacher.npm,
+            "is_enrolled": is_enrolled,
+        }
+    )
+    return response
+
+
+async def _archived_page(
+    archived: "QuerySet[ArchivedCourse]",
+    live_count: t.Callable[[], t.Awaitable[int]],
+    page: int,
+    live_length: int,
+    is_enrolled: bool,
+):
+    """Fill the rest of a page with archived courses once live ones run out.
+    Archived courses are older than every live course, so they come after
+    them, and the archive is only read by pages that reach past the end."""
+    if live_length:
+        offset = 0
+    else:
+        offset = (page - 1) * 10 - await live_count()
+
+    courses = (
+        await archived.select_related("teacher")
+        .order_by("-datetime")
+        .offset(max(offset, 0))
+        .limit(10 - live_length)
+        .all()
+    )
+    return [_create_archived_coursedict(c, is_enrolled) for c in courses]
+
+
+def _ensure_admin(user: User):
+    if not user.is_admin:
+        raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+
+
+async def _update_courses(
+    course_ids: t.List[UUID], **values
+) -> t.Dict[UUID, t.Tuple[str, t.Optional[int]]]:
+    """Apply values to every course in course_ids with one UPDATE. Returns
+    the (matkul, students_limit) each existing course had before, for
+    track_course_changes."""
+    table = Course.Meta.table
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select(
+                [table.c.id, table.c.matkul, table.c.students_limit]
+            ).where(table.c.id.in_(course_ids))
+        )
+        old_values = {row[0]: (row[1], row[2]) for row in rows}
+        if old_values:
+            await database.execute(
+                table.update().where(table.c.id.in_(list(old_values))).values(**values)
+            )
+
+    if old_values:
+        await invalidate_courses(list(old_values), FACETS_ADMIN_KEY, FACETS_PUBLIC_KEY)
+    return old_values
+
+
+async def _publish_bulk_event(event: str, course_ids: t.List[UUID]) -> t.List[Course]:
+    """Publish event for every course in course_ids, returning them."""
+    if not course_ids:
+        return []
+    courses = (
+        await Course.objects.select_related("teacher").filter(id__in=course_ids).all()
+    )
+    for c in courses:
+        await publish_course_event(event, c)
+    return courses
+
+
+async def _fill_from_waitlist(course: Course):
+    promoted = await best_effort(promote_waitlist(course))
+    if promoted:
+        await invalidate_course(course.id, npms=promoted)
+        await track_enrollments(course, len(promoted))
+        students_count: int = await course.students.count()  # type: ignore
+        await publish_course_event("enroll", course, students_count)
+
+
 @router.get(
     "/list",
     response_model=t.List[CourseResponse],
@@ -108,27 +387,68 @@ async def _create_coursedict(course: Course, user: User):
         Depends(RateLimiter(times=300, minutes=1)),
     ],
 )
-async def courses_list(user: User = Depends(manager), page: int = Query(1)):
+async def courses_list(
+    request: Request,
+    response: Response,
+    user: User = Depends(manager),
+    page: int = Query(1),
+    matkul: t.Optional[Subject] = Query(None),
+):
+    (catalog_version,) = await get_versions(CATALOG_VERSION_KEY)
+    etag = make_etag("list", catalog_version, user.npm, user.is_admin, page, matkul)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    queryset = Course.objects
+    if matkul:
+        queryset = queryset.filter(Course.matkul == matkul.value)
+
     courses = (
-        await Course.objects.paginate(page, 10)
+        await queryset.paginate(page, 10)
         .order_by("-datetime")
         .select_related("teacher")
         .all()
     )
-    response = []
+    counts = await _count_students([c.id for c in courses])
+    courses_dict = []
     for c in courses:
-        response.append(await _create_coursedict(c, user))
-    return response
+        courses_dict.append(await _create_coursedict(c, user, counts.get(c.id, 0)))
+    return courses_dict
 
 
 @router.get("/available", response_model=t.List[CourseResponse])
-async def courses_available(user: User = Depends(manager), page: int = Query(1)):
+async def courses_available(
+    request: Request,
+    response: Response,
+    user: User = Depends(manager),
+    page: int = Query(1),
+    matkul: t.Optional[Subject] = Query(None),
+):
     current_time = _current_dt_aware()
 
+    # Courses leave this listing as time passes without any write, so the
+    # tag also changes once per window.
+    (catalog_version,) = await get_versions(CATALOG_VERSION_KEY)
+    etag = make_etag(
+        "available",
+        catalog_version,
+        int(current_time.timestamp()) // AVAILABLE_ETAG_WINDOW,
+        user.npm,
+        user.is_admin,
+        page,
+        matkul,
+    )
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     # Let admin see hidden courses
     filters = Course.datetime >= current_time
     if not user.is_admin:
         filters &= Course.hidden == False  # noqa
+    if matkul:
+        filters &= Course.matkul == matkul.value
 
     courses = (
         await Course.objects.filter(filters)
@@ -137,9 +457,172 @@ async def courses_available(user: User = Depends(manager), page: int = Query(1))
         .select_related("teacher")
         .all()
     )
+    counts = await _count_students([c.id for c in courses])
+    courses_dict = []
+    for c in courses:
+        courses_dict.append(await _create_coursedict(c, user, counts.get(c.id, 0)))
+    return courses_dict
+
+
+@router.get(
+    "/facets",
+    response_model=t.Dict[str, int],
+    dependencies=[
+        Depends(RateLimiter(times=300, minutes=1)),
+    ],
+)
+async def courses_facets(user: User = Depends(manager)):
+    """Count upcoming courses per subject, so clients can show badges
+    without downloading the whole catalog."""
+    redis_key = FACETS_ADMIN_KEY if user.is_admin else FACETS_PUBLIC_KEY
+
+    facets_dict: str = await redis.get(redis_key)
+    if facets_dict:
+        return ujson.loads(facets_dict)
+
+    table = Course.Meta.table
+    query = (
+        sqlalchemy.select([table.c.matkul, sqlalchemy.func.count()])
+        .where(table.c.datetime >= _current_dt_aware())
+        .group_by(table.c.matkul)
+    )
+    if not user.is_admin:
+        query = query.where(table.c.hidden == False)  # noqa
+
+    counts = {subject.name: 0 for subject in Subject}
+    for matkul, count in await database.fetch_all(query):
+        counts[Subject(matkul).name] = count
+
+    # Writes invalidate this, the expiry only catches courses that
+    # stopped being upcoming in the meantime.
+    await redis.set(redis_key, ujson.dumps(counts), ex=FACETS_CACHE_TTL)
+    return counts
+
+
+@router.get(
+    "/export",
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=10)),
+    ],
+)
+async def courses_export(
+    user: User = Depends(manager),
+    fmt: str = Query("csv", alias="format", regex=EXPORT_FORMAT_REGEX),
+):
+    """Export every course with one row per enrolled student. Courses
+    without students get a single row with empty student columns."""
+    _ensure_admin(user)
+
+    courses = Course.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    teachers = User.Meta.table.alias("teachers")
+    students = User.Meta.table.alias("students")
+    query = (
+        sqlalchemy.select(
+            [
+                courses.c.id.label("course_id"),
+                courses.c.name.label("name"),
+                courses.c.matkul.label("matkul"),
+                courses.c.datetime.label("datetime"),
+                courses.c.students_limit.label("students_limit"),
+                courses.c.hidden.label("hidden"),
+                teachers.c.npm.label("teacher_npm"),
+                teachers.c.name.label("teacher_name"),
+                students.c.npm.label("student_npm"),
+                students.c.name.label("student_name"),
+            ]
+        )
+        .select_from(
+            courses.join(teachers, teachers.c.npm == courses.c.teacher)
+            .outerjoin(enrollments, enrollments.c.course == courses.c.id)
+            .outerjoin(students, students.c.npm == enrollments.c.user)
+        )
+        .order_by(courses.c.datetime, courses.c.id, students.c.npm)
+    )
+    columns = [column.name for column in query.selected_columns]
+
+    return StreamingResponse(
+        stream_export(query, columns, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="courses.{fmt}"'},
+    )
+
+
+@router.get(
+    "/stream",
+    dependencies=[
+        Depends(RateLimiter(times=10, minutes=1)),
+    ],
+)
+async def courses_stream(
+    request: Request,
+    user: User = Depends(manager),
+    ids: t.List[UUID] = Query([]),
+):
+    """Push seat count changes, updates and deletions as Server-Sent Events.
+    Only events of the given course IDs are sent, or all of them if none
+    is given."""
+    watched = {str(course_id) for course_id in ids}
+    queue = course_events.subscribe()
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if watched and event["id"] not in watched:
+                    continue
+                if event["hidden"] and not user.is_admin:
+                    continue
+                yield f"event: {event['event']}\ndata: {ujson.dumps(event)}\n\n"
+        finally:
+            course_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get(
+    "/search",
+    response_model=t.List[CourseResponse],
+    dependencies=[
+        Depends(RateLimiter(times=300, minutes=1)),
+    ],
+)
+async def courses_search(
+    user: User = Depends(manager),
+    q: str = Query(..., min_length=1, max_length=100),
+    matkul: t.Optional[Subject] = Query(None),
+    page: int = Query(1, gt=0),
+):
+    # Same visibility rule as /available, admin can find hidden courses
+    course_ids = await search_course_ids(
+        q,
+        matkul=matkul.value if matkul else None,
+        include_hidden=user.is_admin,
+        page=page,
+    )
+    if not course_ids:
+        return []
+
+    courses = (
+        await Course.objects.filter(id__in=course_ids).select_related("teacher").all()
+    )
+    courses.sort(key=lambda c: course_ids.index(c.id))
+
+    counts = await _count_students([c.id for c in courses])
     response = []
     for c in courses:
-        response.append(await _create_coursedict(c, user))
+        response.append(await _create_coursedict(c, user, counts.get(c.id, 0)))
     return response
 
 
@@ -150,16 +633,39 @@ async def courses_available(user: User = Depends(manager), page: int = Query(1))
         Depends(RateLimiter(times=300, minutes=1)),
     ],
 )
-async def courses_mine(user: User = Depends(manager), page: int = Query(1)):
+async def courses_mine(
+    user: User = Depends(manager),
+    page: int = Query(1),
+    matkul: t.Optional[Subject] = Query(None),
+    include_archived: bool = Query(False),
+):
+    filters = Course.teacher.npm == user.npm
+    if matkul:
+        filters &= Course.matkul == matkul.value
+
     courses = (
-        await Course.objects.filter(Course.teacher.npm == user.npm)
+        await Course.objects.filter(filters)
         .paginate(page, 10)
         .order_by("-datetime")
         .all()
     )
+    counts = await _count_students([c.id for c in courses])
     response = []
     for c in courses:
-        response.append(await _create_coursedict(c, user))
+        response.append(await _create_coursedict(c, user, counts.get(c.id, 0)))
+
+    if include_archived and len(response) < 10:
+        archived_filters = ArchivedCourse.teacher.npm == user.npm
+        if matkul:
+            archived_filters &= ArchivedCourse.matkul == matkul.value
+
+        response += await _archived_page(
+            ArchivedCourse.objects.filter(archived_filters),
+            Course.objects.filter(filters).count,
+            page,
+            len(response),
+            is_enrolled=user.is_admin,
+        )
     return response
 
 
@@ -170,27 +676,44 @@ async def courses_mine(user: User = Depends(manager), page: int = Query(1)):
         Depends(RateLimiter(times=300, minutes=1)),
     ],
 )
-async def courses_enrolled(user: User = Depends(manager), page: int = Query(1)):
+async def courses_enrolled(
+    user: User = Depends(manager),
+    page: int = Query(1),
+    matkul: t.Optional[Subject] = Query(None),
+    include_archived: bool = Query(False),
+):
+    filters = Course.students.npm == user.npm
+    if matkul:
+        filters &= Course.matkul == matkul.value
+
     courses = (
-        await user.courses_taken.select_related("teacher")
+        await Course.objects.filter(filters)
+        .select_related("teacher")
         .paginate(page, 10)
         .order_by("-datetime")
         .all()
     )
+    counts = await _count_students([c.id for c in courses])
     response = []
     for c in courses:
-        response.append(await _create_coursedict(c, user))
+        response.append(await _create_coursedict(c, user, counts.get(c.id, 0)))
+
+    if include_archived and len(response) < 10:
+        archived_filters = ArchivedCourse.enrollments.user.npm == user.npm
+        if matkul:
+            archived_filters &= ArchivedCourse.matkul == matkul.value
+
+        response += await _archived_page(
+            ArchivedCourse.objects.filter(archived_filters),
+            Course.objects.filter(filters).count,
+            page,
+            len(response),
+            is_enrolled=True,
+        )
     return response
 
 
-@router.post(
-    "/create",
-    response_model=CourseResponse,
-    dependencies=[
-        Depends(RateLimiter(times=1, seconds=3)),
-    ],
-)
-async def course_create(course: CourseCreate, user: User = Depends(manager)):
+async def _create_course(course: CourseCreate, user: User):
     current_time = _current_dt_aware()
     if course.datetime < current_time:
         raise HTTPException(
@@ -206,10 +729,7 @@ async def course_create(course: CourseCreate, user: User = Depends(manager)):
     if course.link and not _is_invite_url(course.link):
         raise HTTPException(status_code=400, detail="Invalid Meet/Zoom URL.")
 
-    upcoming_user_courses = await Course.objects.filter(
-        (Course.datetime > current_time) & (Course.teacher.npm == user.npm)
-    ).all()
-    if len(upcoming_user_courses) >= 2:
+    if await _count_upcoming_classes(user, current_time) >= MAX_UPCOMING_CLASSES:
         raise HTTPException(
             status_code=400, detail="You can only have at most 2 upcoming classes."
         )
@@ -217,6 +737,14 @@ async def course_create(course: CourseCreate, user: User = Depends(manager)):
     if course.students_limit and course.students_limit <= 0:
         course.students_limit = None
     c = await Course.objects.create(teacher=user, **course.dict())
+    await invalidate_course(
+        c.id,
+        FACETS_ADMIN_KEY,
+        FACETS_PUBLIC_KEY,
+        npms=[user.npm],
+    )
+    await best_effort(schedule_reminder(c))
+    await track_courses([c])
 
     if not course.hidden and settings.discord_url:
         await send_webhook(settings.discord_url, c)
@@ -225,13 +753,351 @@ async def course_create(course: CourseCreate, user: User = Depends(manager)):
 
 
 @router.post(
-    "/{course_id}/enroll",
+    "/create",
+    response_model=CourseResponse,
+    dependencies=[
+        Depends(IdempotentRateLimiter("create", times=1, seconds=3)),
+    ],
+)
+async def course_create(
+    course: CourseCreate,
+    user: User = Depends(manager),
+    idempotency_key: t.Optional[str] = Header(None, max_length=128),
+):
+    return await run_idempotent(
+        idempotency_key,
+        user.npm,
+        "create",
+        course.json(),
+        lambda: _create_course(course, user),
+    )
+
+
+@router.post(
+    "/series",
+    response_model=t.List[CourseResponse],
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def course_series_create(
+    series_data: CourseSeriesCreate,
+    user: User = Depends(manager),
+):
+    current_time = _current_dt_aware()
+    interval = timedelta(days=series_data.interval_days)
+    last_datetime = series_data.datetime + interval * (series_data.occurrences - 1)
+    if series_data.datetime < current_time:
+        raise HTTPException(
+            status_code=400,
+            detail="You cannot pick date and time that happens in the past.",
+        )
+    elif (last_datetime - current_time) > timedelta(days=28):
+        raise HTTPException(
+            status_code=400,
+            detail="Every session must be between now and 30 days from now.",
+        )
+
+    if series_data.link and not _is_invite_url(series_data.link):
+        raise HTTPException(status_code=400, detail="Invalid Meet/Zoom URL.")
+
+    if await _count_upcoming_series(user, current_time) >= MAX_UPCOMING_SERIES:
+        raise HTTPException(
+            status_code=400, detail="You can only have at most 1 upcoming series."
+        )
+
+    if series_data.students_limit and series_data.students_limit <= 0:
+        series_data.students_limit = None
+    course_data = series_data.dict(exclude={"datetime", "interval_days", "occurrences"})
+
+    async with database.transaction():
+        series = await CourseSeries.objects.create(
+            teacher=user,
+            starts_at=series_data.datetime,
+            interval_days=series_data.interval_days,
+            occurrences=series_data.occurrences,
+            **course_data,
+        )
+        courses = [
+            Course(
+                teacher=user,
+                series=series,
+                datetime=series_data.datetime + interval * i,
+                **course_data,
+            )
+            for i in range(series_data.occurrences)
+        ]
+        await database.execute(
+            Course.Meta.table.insert().values(
+                [
+                    {
+                        **course_data,
+                        "id": c.id,
+                        "datetime": c.datetime,
+                        "teacher": user.npm,
+                        "series": series.id,
+                    }
+                    for c in courses
+                ]
+            )
+        )
+
+    await invalidate_courses(
+        [c.id for c in courses],
+        FACETS_ADMIN_KEY,
+        FACETS_PUBLIC_KEY,
+        npms=[user.npm],
+    )
+    await best_effort(schedule_reminders(courses))
+    await track_courses(courses)
+
+    if not series_data.hidden and settings.discord_url:
+        await send_series_webhook(settings.discord_url, courses)
+
+    return [await _create_coursedict(c, user, student_count=0) for c in courses]
+
+
+@router.post(
+    "/series/{series_id}/update",
     response_model=DefaultResponse,
     dependencies=[
-        Depends(RateLimiter(times=1, seconds=1)),
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def course_series_update(
+    series_id: UUID,
+    series_data: CourseSeriesUpdate,
+    user: User = Depends(manager),
+):
+    """Apply changes to every upcoming occurrence of a series. Sessions
+    that already happened keep their details."""
+    if series_data.link and not _is_invite_url(series_data.link):
+        raise HTTPException(status_code=400, detail="Invalid Meet/Zoom URL.")
+
+    series = await CourseSeries.objects.select_related("teacher").get_or_none(
+        id=series_id
+    )
+    if not series:
+        raise HTTPException(status_code=404, detail="Series not found!")
+    if user != series.teacher and not user.is_admin:
+        raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+
+    if series_data.students_limit and series_data.students_limit <= 0:
+        series_data.students_limit = None
+
+    is_limit_raised = bool(series.students_limit) and (
+        not series_data.students_limit
+        or series_data.students_limit > series.students_limit
+    )
+    table = Course.Meta.table
+    upcoming = (table.c.series == series.id) & (table.c.datetime > _current_dt_aware())
+    # The raw update skips ormar's choices check, matkul is validated as
+    # Subject and stored by value
+    values: t.Dict[str, t.Any] = {
+        **series_data.dict(),
+        "matkul": series_data.matkul.value,
+    }
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select(
+                [table.c.id, table.c.matkul, table.c.students_limit]
+            ).where(upcoming)
+        )
+        await database.execute(table.update().where(upcoming).values(**values))
+        await series.update(**values)
+
+    old_values = {row[0]: (row[1], row[2]) for row in rows}
+    course_ids = list(old_values)
+    if not course_ids:
+        return {"message": "Series updated."}
+
+    await invalidate_courses(course_ids, FACETS_ADMIN_KEY, FACETS_PUBLIC_KEY)
+
+    courses = (
+        await Course.objects.select_related("teacher").filter(id__in=course_ids).all()
+    )
+    await track_course_changes(courses, old_values, await _count_students(course_ids))
+    for c in courses:
+        if is_limit_raised:
+            await _fill_from_waitlist(c)
+        await publish_course_event("update", c)
+    return {"message": "Series updated."}
+
+
+@router.post(
+    "/bulk/visibility",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def courses_bulk_visibility(
+    bulk_data: CourseBulkVisibility,
+    user: User = Depends(manager),
+):
+    _ensure_admin(user)
+    course_ids = list(
+        await _update_courses(bulk_data.course_ids, hidden=bulk_data.hidden)
+    )
+    await _publish_bulk_event("update", course_ids)
+    state = "hidden" if bulk_data.hidden else "visible"
+    return {"message": f"{len(course_ids)} courses are now {state}."}
+
+
+@router.post(
+    "/bulk/move",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def courses_bulk_move(
+    bulk_data: CourseBulkMove,
+    user: User = Depends(manager),
+):
+    _ensure_admin(user)
+    old_values = await _update_courses(
+        bulk_data.course_ids, matkul=bulk_data.matkul.value
+    )
+    course_ids = list(old_values)
+    courses = await _publish_bulk_event("update", course_ids)
+    await track_course_changes(courses, old_values, await _count_students(course_ids))
+    return {"message": f"{len(course_ids)} courses moved."}
+
+
+@router.post(
+    "/bulk/delete",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=10)),
+    ],
+)
+async def courses_bulk_delete(
+    bulk_data: CourseBulk,
+    user: User = Depends(manager),
+):
+    _ensure_admin(user)
+    table = Course.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+
+    courses = (
+        await Course.objects.select_related("teacher")
+        .filter(id__in=bulk_data.course_ids)
+        .all()
+    )
+    course_ids = [c.id for c in courses]
+    if not course_ids:
+        return {"message": "0 courses deleted."}
+
+    students_counts = await _count_students(course_ids)
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select([enrollments.c.user])
+            .where(enrollments.c.course.in_(course_ids))
+            .distinct()
+        )
+        await database.execute(
+            enrollments.delete().where(enrollments.c.course.in_(course_ids))
+        )
+        await database.execute(table.delete().where(table.c.id.in_(course_ids)))
+
+    npms = {row[0] for row in rows} | {c.teacher.npm for c in courses}
+    await invalidate_courses(course_ids, FACETS_ADMIN_KEY, FACETS_PUBLIC_KEY, npms=npms)
+    await best_effort(delete_waitlists(course_ids))
+    await best_effort(cancel_reminders(course_ids))
+    await track_courses(courses, students_counts, removed=True)
+    for c in courses:
+        await publish_course_event("delete", c)
+    return {"message": f"{len(course_ids)} courses deleted."}
+
+
+@router.post(
+    "/bulk/enroll",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def course_bulk_enroll(
+    bulk_data: CourseBulkEnrollment,
+    user: User = Depends(manager),
+):
+    """Enroll every listed user that exists and is not enrolled yet. Admins
+    may go past the students limit."""
+    _ensure_admin(user)
+    c = await Course.objects.select_related("teacher").get_or_none(
+        id=bulk_data.course_id
+    )
+    if not c:
+        raise HTTPException(status_code=404, detail="Course not found!")
+
+    users = User.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    enrolled = sqlalchemy.select([enrollments.c.user]).where(
+        enrollments.c.course == c.id
+    )
+    candidates = (
+        (users.c.npm != c.teacher.npm)
+        & users.c.npm.not_in(enrolled)
+        & users.c.npm.in_(bulk_data.npms)
+    )
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select([users.c.npm]).where(candidates)
+        )
+        npms = [row[0] for row in rows]
+        if npms:
+            await database.execute(
+                enrollments.insert().values(
+                    [{"course": c.id, "user": npm} for npm in npms]
+                )
+            )
+
+    if npms:
+        await invalidate_course(c.id, npms=npms)
+        await track_enrollments(c, len(npms))
+        students_count: int = await c.students.count()  # type: ignore
+        await publish_course_event("enroll", c, students_count)
+    return {"message": f"{len(npms)} users enrolled."}
+
+
+@router.post(
+    "/bulk/unenroll",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
     ],
 )
-async def course_enroll(course_id: UUID, user: User = Depends(manager)):
+async def course_bulk_unenroll(
+    bulk_data: CourseBulkEnrollment,
+    user: User = Depends(manager),
+):
+    _ensure_admin(user)
+    c = await Course.objects.select_related("teacher").get_or_none(
+        id=bulk_data.course_id
+    )
+    if not c:
+        raise HTTPException(status_code=404, detail="Course not found!")
+
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    selected = (enrollments.c.course == c.id) & (enrollments.c.user.in_(bulk_data.npms))
+    async with database.transaction():
+        rows = await database.fetch_all(
+            sqlalchemy.select([enrollments.c.user]).where(selected)
+        )
+        await database.execute(enrollments.delete().where(selected))
+
+    npms = [row[0] for row in rows]
+    if npms:
+        await invalidate_course(c.id, npms=npms)
+        await track_enrollments(c, -len(npms))
+        students_count: int = await c.students.count()  # type: ignore
+        await publish_course_event("unenroll", c, students_count)
+        await _fill_from_waitlist(c)
+    return {"message": f"{len(npms)} users unenrolled."}
+
+
+async def _enroll_course(course_id: UUID, user: User):
     redis_key = f"{str(course_id)}--detail"
 
     c = await Course.objects.select_related("teacher").get_or_none(id=course_id)
@@ -251,10 +1117,35 @@ async def course_enroll(course_id: UUID, user: User = Depends(manager)):
         raise HTTPException(status_code=403, detail="Course is already full.")
 
     await c.students.add(user)
-    await redis.delete(redis_key)
+    await invalidate_course(c.id, redis_key, npms=[user.npm])
+    await track_enrollments(c, 1)
+    await best_effort(leave_waitlist(c.id, user.npm))
+    students_count: int = await c.students.count()  # type: ignore
+    await publish_course_event("enroll", c, students_count)
     return {"message": "Successfully enrolled!"}
 
 
+@router.post(
+    "/{course_id}/enroll",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(IdempotentRateLimiter("enroll", times=1, seconds=1)),
+    ],
+)
+async def course_enroll(
+    course_id: UUID,
+    user: User = Depends(manager),
+    idempotency_key: t.Optional[str] = Header(None, max_length=128),
+):
+    return await run_idempotent(
+        idempotency_key,
+        user.npm,
+        "enroll",
+        str(course_id),
+        lambda: _enroll_course(course_id, user),
+    )
+
+
 @router.post(
     "/{course_id}/unenroll",
     response_model=DefaultResponse,
@@ -278,16 +1169,81 @@ async def course_unenroll(course_id: UUID, user: User = Depends(manager)):
         )
 
     await c.students.remove(user)
-    await redis.delete(redis_key)
+    await invalidate_course(c.id, redis_key, npms=[user.npm])
+    await track_enrollments(c, -1)
+    students_count: int = await c.students.count()  # type: ignore
+    await publish_course_event("unenroll", c, students_count)
+    await _fill_from_waitlist(c)
     return {"message": "Unenrolled from course."}
 
 
+@router.post(
+    "/{course_id}/waitlist/join",
+    response_model=WaitlistResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=1)),
+    ],
+)
+async def course_waitlist_join(course_id: UUID, user: User = Depends(manager)):
+    c = await Course.objects.select_related("teacher").get_or_none(id=course_id)
+    if not c:
+        raise HTTPException(status_code=404, detail="Course not found!")
+    if c.teacher == user:
+        raise HTTPException(
+            status_code=403, detail="You cannot enroll to your own course."
+        )
+
+    # Same as course_enroll, c.datetime is not timezone aware
+    current_time = _current_dt_aware().replace(tzinfo=pytz.utc) - timedelta(hours=7)
+    if current_time > c.datetime:
+        raise HTTPException(status_code=403, detail="Course has already started!")
+    if await c.students.filter(npm=user.npm).exists():
+        raise HTTPException(
+            status_code=403, detail="You are already enrolled to this course."
+        )
+    if not c.students_limit or (await c.students.count()) < c.students_limit:  # type: ignore
+        raise HTTPException(
+            status_code=400, detail="Course is not full, enroll to it instead."
+        )
+
+    return {"position": await join_waitlist(c, user.npm)}
+
+
+@router.post(
+    "/{course_id}/waitlist/leave",
+    response_model=DefaultResponse,
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=1)),
+    ],
+)
+async def course_waitlist_leave(course_id: UUID, user: User = Depends(manager)):
+    if not await leave_waitlist(course_id, user.npm):
+        raise HTTPException(
+            status_code=404, detail="You are not in the waitlist of this course."
+        )
+    return {"message": "Left the waitlist."}
+
+
+@router.get(
+    "/{course_id}/waitlist",
+    response_model=WaitlistResponse,
+    dependencies=[Depends(RateLimiter(times=20, seconds=1))],
+)
+async def course_waitlist_position(course_id: UUID, user: User = Depends(manager)):
+    return {"position": await waitlist_position(course_id, user.npm)}
+
+
 @router.get(
     "/{course_id}/detail",
     response_model=CourseDetailReponse,
     dependencies=[Depends(RateLimiter(times=20, seconds=1))],
 )
-async def course_detail(course_id: UUID, user: User = Depends(manager)):
+async def course_detail(
+    course_id: UUID,
+    request: Request,
+    response: Response,
+    user: User = Depends(manager),
+):
     redis_key = f"{str(course_id)}--detail"
 
     can_fetch = _can_fetch_details(course_id, user)
@@ -296,17 +1252,26 @@ async def course_detail(course_id: UUID, user: User = Depends(manager)):
             status_code=401, detail="You are not enrolled to this course."
         )
 
-    # Search if cache exist in redis
-    course_dict: str = await redis.get(redis_key)
-    if course_dict:
-        return ujson.loads(course_dict)
-
-    c = await Course.objects.select_related("teacher").get_or_none(id=course_id)
-    if not c:
-        raise HTTPException(status_code=404, detail="Course not found!")
-
-    course_dict = await _create_coursedict(c, user)
-    await redis.set(redis_key, ujson.dumps(course_dict))
+    (course_version,) = await get_versions(course_version_key(course_id))
+    etag = make_etag("detail", course_version, user.npm, user.is_admin)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    # Search if cache exist in redis. The cached copy is shared by every
+    # user, so is_enrolled is filled in per request.
+    cached: str = await redis.get(redis_key)
+    if cached:
+        course_dict = ujson.loads(cached)
+    else:
+        c = await Course.objects.select_related("teacher").get_or_none(id=course_id)
+        if not c:
+            raise HTTPException(status_code=404, detail="Course not found!")
+
+        course_dict = await _create_coursedict(c, user)
+        await redis.set(redis_key, ujson.dumps(course_dict))
+
+    course_dict["is_enrolled"] = _is_enrolled(course_id, user)
     return course_dict
 
 
@@ -339,6 +1304,39 @@ async def course_students(
     return resp
 
 
+@router.get(
+    "/{course_id}/roster",
+    dependencies=[
+        Depends(RateLimiter(times=1, seconds=3)),
+    ],
+)
+async def course_roster(
+    course_id: UUID,
+    user: User = Depends(manager),
+    fmt: str = Query("csv", alias="format", regex=EXPORT_FORMAT_REGEX),
+):
+    c = await Course.objects.select_related("teacher").get_or_none(id=course_id)
+    if not c:
+        raise HTTPException(status_code=404, detail="Course not found!")
+    if user != c.teacher and not user.is_admin:
+        raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+
+    users = User.Meta.table
+    enrollments = Course.Meta.model_fields["students"].through.Meta.table
+    query = (
+        sqlalchemy.select([users.c.npm, users.c.username, users.c.name])
+        .select_from(users.join(enrollments, enrollments.c.user == users.c.npm))
+        .where(enrollments.c.course == c.id)
+        .order_by(users.c.name)
+    )
+
+    return StreamingResponse(
+        stream_export(query, ["npm", "username", "name"], fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="roster-{c.id}.{fmt}"'},
+    )
+
+
 @router.post(
     "/{course_id}/update",
     response_model=CourseDetailReponse,
@@ -381,9 +1379,29 @@ async def course_update(
 
     if course_data.students_limit and course_data.students_limit <= 0:
         course_data.students_limit = None
+    is_limit_raised = bool(c.students_limit) and (
+        not course_data.students_limit or course_data.students_limit > c.students_limit
+    )
+    old_matkul, old_students_limit = c.matkul, c.students_limit
     await c.update(**course_data.dict())
-    await redis.delete(redis_key)
-    return await _create_coursedict(c, user)
+    await invalidate_course(c.id, redis_key, FACETS_ADMIN_KEY, FACETS_PUBLIC_KEY)
+    if is_dt_changed:
+        # The old reminder would fire after the class already started, drop
+        # it when the new one is already due
+        remind_at = c.datetime - timedelta(minutes=settings.reminder_before)
+        if remind_at > current_time:
+            await best_effort(schedule_reminder(c))
+        else:
+            await best_effort(cancel_reminder(c.id))
+    if is_limit_raised:
+        await _fill_from_waitlist(c)
+
+    course_dict = await _create_coursedict(c, user)
+    await track_course_change(
+        c, old_matkul, old_students_limit, course_dict["students_count"]
+    )
+    await publish_course_event("update", c, course_dict["students_count"])
+    return course_dict
 
 
 @router.delete(
@@ -401,7 +1419,12 @@ async def course_delete(course_id: UUID, user: User = Depends(manager)):
         raise HTTPException(status_code=404, detail="Course not found!")
     if user != c.teacher and not user.is_admin:
         raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+    students_count: int = await c.students.count()  # type: ignore
     await c.delete()
 
-    await redis.delete(redis_key)
+    await invalidate_course(c.id, redis_key, FACETS_ADMIN_KEY, FACETS_PUBLIC_KEY)
+    await best_effort(delete_waitlists([c.id]))
+    await best_effort(cancel_reminder(c.id))
+    await track_courses([c], {c.id: students_count}, removed=True)
+    await publish_course_event("delete", c)
     return {"message": "Course deleted."}
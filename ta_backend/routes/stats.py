@@ -0,0 +1,40 @@
+import typing as t
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi_limiter.depends import RateLimiter
+
+from ta_backend.helper.stats import get_leaderboard, get_stats
+from ta_backend.models import User
+from ta_backend.plugins import manager
+from ta_backend.responses import LeaderboardEntry, StatsResponse
+
+router = APIRouter(
+    prefix="/stats",
+    dependencies=[
+        Depends(manager),
+        Depends(RateLimiter(times=60, minutes=1)),
+    ],
+)
+
+
+def _ensure_admin(user: User):
+    if not user.is_admin:
+        raise HTTPException(status_code=401, detail="You are not allowed to do this.")
+
+
+@router.get("", response_model=StatsResponse)
+async def stats(user: User = Depends(manager)):
+    """Totals and per subject numbers, read from the counters kept in Redis
+    instead of the database."""
+    _ensure_admin(user)
+    return await get_stats()
+
+
+@router.get("/leaderboard", response_model=t.List[LeaderboardEntry])
+async def stats_leaderboard(
+    user: User = Depends(manager),
+    by: str = Query("students", regex="^(students|courses)$"),
+    limit: int = Query(10, gt=0, le=100),
+):
+    _ensure_admin(user)
+    return await get_leaderboard(by, limit)
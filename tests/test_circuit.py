@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+from fastapi_limiter import FastAPILimiter
+
+from ta_backend.helper.circuit import RedisUnavailable, ResilientRedis
+
+TIMEOUT = 0.05
+
+
+class StubPipeline:
+    def __init__(self, stub):
+        self.stub = stub
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        await self.stub._check()
+        return []
+
+
+class StubRedis:
+    """Redis stand-in whose failure mode can be switched at runtime."""
+
+    def __init__(self):
+        self.data = {}
+        self.mode = "ok"
+        self.calls = 0
+
+    async def _check(self):
+        self.calls += 1
+        if self.mode == "stall":
+            await asyncio.sleep(10)
+        elif self.mode == "error":
+            raise ConnectionError("Connection refused")
+
+    async def get(self, name):
+        await self._check()
+        return self.data.get(name)
+
+    async def set(self, name, value, **kwargs):
+        await self._check()
+        self.data[name] = str(value)
+        return True
+
+    async def delete(self, *names):
+        await self._check()
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+    def pipeline(self, transaction=True):
+        return StubPipeline(self)
+
+    async def script_load(self, script):
+        await self._check()
+        return "sha"
+
+    async def scan_iter(self, count=None):
+        await self._check()
+        for key in list(self.data):
+            yield key
+
+
+def _make(stub: StubRedis, reset_timeout: float = 60) -> ResilientRedis:
+    return ResilientRedis(
+        stub,
+        timeout=TIMEOUT,
+        reset_timeout=reset_timeout,
+        flush_timeout=1,
+        cache_patterns=["*--detail", "catalog--version"],
+    )
+
+
+def test_stalled_redis_is_bounded_by_timeout():
+    async def scenario():
+        stub = StubRedis()
+        redis = _make(stub)
+        stub.mode = "stall"
+
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        await redis.set("a--detail", "cached")
+        assert loop.time() - started < TIMEOUT * 4
+        assert redis.is_open
+
+        # Served from memory without waiting on Redis again
+        calls = stub.calls
+        started = loop.time()
+        assert await redis.get("a--detail") == "cached"
+        assert loop.time() - started < TIMEOUT
+        assert stub.calls == calls
+
+    asyncio.run(scenario())
+
+
+def test_pipeline_and_limiter_fall_back_to_memory():
+    async def scenario():
+        stub = StubRedis()
+        redis = _make(stub)
+        stub.mode = "error"
+
+        pipe = redis.pipeline(transaction=False)
+        pipe.incr("catalog--version")
+        pipe.delete("a--detail")
+        assert await pipe.execute() == [1, 0]
+
+        sha = await redis.script_load(FastAPILimiter.lua_script)
+        results = [await redis.evalsha(sha, 1, "limit", "2", "1000") for _ in range(3)]
+        assert results[:2] == [0, 0]
+        assert 0 < results[2] <= 1000
+
+    asyncio.run(scenario())
+
+
+def test_recovery_flushes_cache_keys():
+    async def scenario():
+        stub = StubRedis()
+        stub.data = {"a--detail": "stale", "a--session": "kept"}
+        redis = _make(stub, reset_timeout=0)
+        stub.mode = "error"
+        await redis.delete("a--detail")
+        assert redis.is_open
+
+        stub.mode = "ok"
+        await redis.get("b--detail")  # Starts the recovery in background
+        await asyncio.sleep(0.1)
+
+        assert not redis.is_open
+        assert stub.data == {"a--session": "kept"}
+        assert await redis.get("a--detail") is None
+
+    asyncio.run(scenario())
+
+
+def test_other_commands_fail_instead_of_using_memory():
+    async def scenario():
+        stub = StubRedis()
+        redis = _make(stub)
+        stub.mode = "error"
+
+        with pytest.raises(RedisUnavailable):
+            await redis.set("archive--lock", 1, nx=True)
+        assert redis.is_open
+
+        # Open circuit, nothing reaches Redis
+        calls = stub.calls
+        with pytest.raises(RedisUnavailable):
+            await redis.zadd("reminders--queue", {"course": 1})
+        pipe = redis.pipeline()
+        pipe.delete("a--detail")
+        pipe.sadd("1--sessions", "session")
+        with pytest.raises(RedisUnavailable):
+            await pipe.execute()
+        assert stub.calls == calls
+
+    asyncio.run(scenario())
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "outage.db")
+os.environ.update(
+    database_url=f"sqlite:///{DB_PATH}",
+    redis_url="redis://localhost:6379",
+    secret="secret",
+    hostname="localhost",
+)
+
+import sqlalchemy  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ta_backend.app import app  # noqa: E402
+from ta_backend.helper.database import metadata  # noqa: E402
+from ta_backend.plugins import manager, redis  # noqa: E402
+
+
+class RefusingRedis:
+    """Redis whose every call fails as if the server was down."""
+
+    def __getattr__(self, name):
+        raise ConnectionRefusedError("Connection refused")
+
+
+def _sql(query: str, *args):
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(query, args).fetchall()
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def _client() -> TestClient:
+    client = TestClient(app)
+    token = manager.create_access_token(data={"sub": {"npm": 1, "username": "u1"}})
+    client.cookies.set(manager.cookie_name, token)
+    return client
+
+
+def _course_body() -> dict:
+    start = datetime.utcnow() + timedelta(hours=7 + 24)
+    return {
+        "name": "Kalkulus session",
+        "matkul": "kalkulus",
+        "datetime": start.replace(microsecond=0).isoformat(),
+        "hidden": False,
+    }
+
+
+def setup_module():
+    # Other tests close the loop TestClient would pick up
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    metadata.create_all(sqlalchemy.create_engine(os.environ["database_url"]))
+    _sql("INSERT INTO users(npm, username, name, is_admin) VALUES (1, 'u1', 'A', 0)")
+    redis.client = RefusingRedis()
+
+
+def test_writes_during_outage_succeed_or_change_nothing():
+    with _client() as client:
+        # Committed writes keep their response, Redis side effects are
+        # skipped
+        response = client.post("/course/create", json=_course_body())
+        assert response.status_code == 200
+        course_id = response.json()["id"]
+        assert _sql("SELECT COUNT(*) FROM courses") == [(1,)]
+
+        # Idempotency records live in Redis, so the request is refused
+        # before anything is written
+        response = client.post(
+            "/course/create",
+            json=_course_body(),
+            headers={"Idempotency-Key": "retry"},
+        )
+        assert response.status_code == 503
+        assert _sql("SELECT COUNT(*) FROM courses") == [(1,)]
+
+        response = client.delete(f"/course/{course_id}/delete")
+        assert response.status_code == 200
+        assert _sql("SELECT COUNT(*) FROM courses") == [(0,)]